@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+from urllib.parse import urlsplit, parse_qs, quote
+from threading import Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 本地模拟扇贝接口，供benchmark使用：单词数、延迟、错误率都可以配置
+# 指定fixtures目录时，优先返回其中录制好的JSON(文件名为quote(路径?参数).json)
+
+
+class FakeShanbay:
+    def __init__(self, words=500, books=20, chapters=30, latency=0.0, errorRate=0.0, audioSize=16 * 1024, fixtures=None, seed=1):
+        self.words = words
+        self.books = books
+        self.chapters = chapters
+        self.latency = latency
+        self.errorRate = errorRate
+        self.audioSize = audioSize
+        self.fixtures = fixtures
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.stats = {}
+        self.ids = [f'v{i:06d}' for i in range(words)]
+        # 越靠前的单词越新，和扇贝的排序一致
+        self.updatedAt = {w: time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1600000000 + (words - i) * 60)) for i, w in enumerate(self.ids)}
+
+    def count(self, endpoint, status):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {})
+            stats[status] = stats.get(status, 0) + 1
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.errorRate
+
+    def wordList(self, query):
+        if 'page' not in query:
+            return {'total': self.words}
+        ipp = int(query.get('ipp', ['50'])[0])
+        page = int(query['page'][0])
+        ids = self.ids[(page - 1) * ipp: page * ipp]
+        return {'total': self.words, 'objects': [{'vocabulary': {'id': w}, 'updated_at': self.updatedAt[w]} for w in ids]}
+
+    def word(self, word, host):
+        i = int(word[1:])
+        objects = []
+        for k in range(1 + i % 3):
+            n = i * 7 + k
+            objective = {'article_code': f'a{n % self.books}_{n % self.chapters}', 'paragraph_code': f'p{n % 13}', 'sentence_code': f's{n % (self.words // 2 + 1)}'}
+            if n % 5:
+                objective['book_code'] = f'b{n % self.books}'
+            objects.append({'app_name': '扇贝阅读', 'updated_at': self.updatedAt[word], 'source_name': 'The Economist',
+                            'source_content': f'A sentence with <vocab>word{i}</vocab> number {k}.', 'objective': objective})
+        return {
+            'vocabulary': {
+                'word': f'word{i}',
+                'senses': [{'pos': 'n.', 'definition_cn': f'释义{i}'}, {'pos': 'v.', 'definition_cn': f'动词{i}'}],
+                'sound': {'ipa_uk': f'wɜːd{i}', 'ipa_us': f'wɝːd{i}',
+                          'audio_uk_urls': [f'http://{host}/audio/uk/{word}.mp3'], 'audio_us_urls': [f'http://{host}/audio/us/{word}.mp3']},
+            },
+            'objects': objects,
+        }
+
+    def examples(self, word):
+        i = int(word[1:])
+        return [{'content_en': f'Example {k} of <vocab>word{i}</vocab>.', 'content_cn': f'例句{k}'} for k in range(i % 4)]
+
+    def catalogs(self, book):
+        index = book[1:]
+        return {'book': {'name_cn': f'书{index}', 'name_en': f'Book {index}'},
+                'catalogs': [{'id': f'a{index}_{c}', 'title_cn': f'第{c}章', 'title_en': f'Chapter {c}'} for c in range(self.chapters)]}
+
+    def article(self, chapter):
+        book, index = chapter[1:].split('_')
+        return {'id': chapter, 'book_id': f'b{book}', 'title_cn': f'第{index}章', 'title_en': f'Chapter {index}'}
+
+    def route(self, path, query, host):
+        parts = path.strip('/').split('/')
+        if parts == ['bayuser', 'user_detail']:
+            return 'user', {'id': 1}
+        if parts == ['wordscollection', 'words']:
+            return 'words', self.wordList(query)
+        if parts[:2] == ['wordscollection', 'words'] and len(parts) == 3:
+            return 'word', self.word(parts[2], host)
+        if parts[:3] == ['abc', 'words', 'vocabularies'] and parts[-1] == 'examples':
+            return 'examples', self.examples(parts[3])
+        if parts == ['reading', 'bilingual']:
+            return 'translate', {'text': 'translated ' + query['sentence_id'][0]}
+        if parts[:2] == ['reading', 'articles']:
+            return 'article', self.article(parts[2])
+        if parts[:2] == ['reading', 'books'] and parts[-1] == 'static_catalogs':
+            return 'catalogs', self.catalogs(parts[2])
+        return None, None
+
+    def audio(self, path):
+        seed = hashlib.sha1(path.encode('utf-8')).digest()
+        return (seed * (self.audioSize // len(seed) + 1))[:self.audioSize]
+
+
+def makeHandler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 头和内容分两次写入，保持连接时Nagle算法加上延迟确认会让每个请求多等40毫秒
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, endpoint, status, body=b'', headers=()):
+            fake.count(endpoint, status)
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/__stats':
+                with fake.lock:
+                    body = json.dumps(fake.stats).encode('utf-8')
+                    fake.stats = {}
+                return self.send_json(body)
+            if fake.latency:
+                time.sleep(fake.latency * (0.5 + fake.random.random()))
+
+            if url.path.startswith('/audio/'):
+                return self.serve_audio(url.path)
+            if fake.fixtures:
+                fixture = os.path.join(fake.fixtures, quote(self.path, safe='') + '.json')
+                if os.path.exists(fixture):
+                    with open(fixture, 'rb') as f:
+                        return self.serve('fixture', f.read())
+
+            endpoint, data = fake.route(url.path, parse_qs(url.query), self.headers.get('Host'))
+            if endpoint is None:
+                return self.reply('unknown', 404)
+            if fake.fail():
+                if fake.random.random() < 0.5:
+                    return self.reply(endpoint, 429, headers=[('Retry-After', '1')])
+                return self.reply(endpoint, 503)
+            self.serve(endpoint, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+        def serve(self, endpoint, body):
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.reply(endpoint, 304, headers=[('ETag', etag)])
+            self.reply(endpoint, 200, body, [('Content-Type', 'application/json'), ('ETag', etag)])
+
+        def send_json(self, body):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def serve_audio(self, path):
+            body = fake.audio(path)
+            headers = [('Content-Type', 'audio/mpeg'), ('ETag', '"' + hashlib.sha1(body).hexdigest() + '"'), ('Accept-Ranges', 'bytes')]
+            ranges = self.headers.get('Range')
+            if ranges and ranges.startswith('bytes=') and ranges.endswith('-'):
+                offset = int(ranges[6:-1])
+                return self.reply('audio', 206, body[offset:], headers + [('Content-Range', f'bytes {offset}-{len(body) - 1}/{len(body)}')])
+            self.reply('audio', 200, body, headers)
+
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(port=0, ready=None, **options):
+    server = Server(('127.0.0.1', port), makeHandler(FakeShanbay(**options)))
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟扇贝接口')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--words', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的平均延迟(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回429/503的比例')
+    parser.add_argument('--fixtures', help='录制的JSON所在目录')
+    args = parser.parse_args()
+    print(f'http://127.0.0.1:{args.port}/')
+    serve(args.port, words=args.words, latency=args.latency, errorRate=args.error_rate, fixtures=args.fixtures)
+
+
+if __name__ == '__main__':
+    main()
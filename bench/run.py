@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.shanbayAPI import ShanbayAPI
+from src.scheduler import SyncScheduler
+from src.exporter import exportWordBook
+from src.audioStore import AudioStore
+from src.misc import Executor
+from src.netStats import stats as netStats
+from bench.fakeShanbay import serve
+
+# 用法: python -m bench.run --words 2000 --latency 0.05 --error-rate 0.01 --output bench_output.txt
+CONFIG = {
+    'titleCN': False, 'webLink': False, 'appLink': True,
+    'BrEPhonetic': True, 'AmEPhonetic': False, 'BrEPron': True, 'AmEPron': False,
+}
+
+
+def resetPeakRSS():
+    # Linux下写入5可以重置VmHWM，这样每一阶段的峰值内存互不影响
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peakRSS():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Bench:
+    def __init__(self, apiUrl, args):
+        self.apiUrl = apiUrl
+        self.args = args
+        self.results = []
+
+    def serverStats(self):
+        with urlopen(self.apiUrl + '__stats') as r:
+            return json.load(r)
+
+    def measure(self, name, fn, unit):
+        self.serverStats()
+        netStats.reset()
+        resetPeakRSS()
+        start = time.perf_counter()
+        items = fn()
+        wall = time.perf_counter() - start
+        stats = self.serverStats()
+        requests = sum(n for statuses in stats.values() for n in statuses.values())
+        errors = sum(n for statuses in stats.values() for status, n in statuses.items() if int(status) >= 400)
+        result = dict(name=name, wall=round(wall, 3), items=items, unit=unit, itemsPerSecond=round(items / wall, 1) if wall else 0,
+                      requests=requests, errors=errors, requestsPerSecond=round(requests / wall, 1) if wall else 0,
+                      peakRSS=round(peakRSS(), 1), endpoints=stats, client=netStats.toDict()['endpoints'])
+        self.results.append(result)
+        print(f"{name:<12} {wall:8.2f}s {items:7d} {unit:<8} {result['itemsPerSecond']:9.1f}/s "
+              f"{requests:6d} req {result['requestsPerSecond']:8.1f} req/s {errors:4d} err {result['peakRSS']:8.1f} MB", flush=True)
+
+    def api(self):
+        api = ShanbayAPI(self.args.cache_size, cacheDir='.')
+        api.apiUrl = self.apiUrl
+        return api
+
+    def paging(self):
+        api = self.api()
+        with Executor(self.args.concurrency, name='paging') as executor:
+            return sum(len(wordList) for _, wordList, _, _ in api.getWordsToSync(False, api.getWordNumber(), executor))
+
+    def sync(self, example, translate):
+        api = self.api()
+        scheduler = SyncScheduler(api, self.args.concurrency, True, example=example, translate=translate)
+        done = []
+        scheduler.onTick = lambda: done.append(1)
+        scheduler.run(api.getWordNumber())
+        return len(done)
+
+    def deck(self):
+        api = self.api()
+        books = [name for name, _ in api.getAllBooks()]
+        return exportWordBook(api, 'bench.apkg', books, CONFIG, 'bench', '.')
+
+    def audio(self):
+        api = self.api()
+        audios = []
+        for _ in api.iterWordBook([name for name, _ in api.getAllBooks()], CONFIG, audios):
+            pass
+        store = AudioStore('shanbay2anki.db', '.')
+        audios = store.missing(audios)
+        with Executor(self.args.audio_concurrency, name='audio') as executor:
+            for fileName, url in audios:
+                executor.submit(store.download, fileName, url)
+        return len(audios)
+
+    def run(self):
+        try:
+            from src.bays import convert
+            translate = True
+        except ModuleNotFoundError:
+            translate = False
+            print('没有找到翻译模块，跳过原句翻译', flush=True)
+
+        self.measure('paging', self.paging, 'words')
+        self.measure('details', lambda: self.sync(False, False), 'words')
+        self.measure('enrichment', lambda: self.sync(True, translate), 'jobs')
+        self.measure('deck', self.deck, 'notes')
+        self.measure('audio', self.audio, 'files')
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用本地模拟的扇贝接口测试同步和制卡性能')
+    parser.add_argument('--words', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02, help='每个请求的平均延迟(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回429/503的比例')
+    parser.add_argument('--fixtures', help='录制的JSON所在目录')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--audio-concurrency', type=int, default=3)
+    parser.add_argument('--cache-size', type=int, default=64)
+    parser.add_argument('--output', help='把结果作为一行JSON追加到这个文件，便于比较不同提交')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, kwargs=dict(ready=ready, words=args.words, latency=args.latency,
+                                                               errorRate=args.error_rate, fixtures=args.fixtures), daemon=True)
+    server.start()
+    apiUrl = f'http://127.0.0.1:{ready.get()}/'
+    commit = gitCommit()
+    output = os.path.abspath(args.output) if args.output else None
+
+    bench = Bench(apiUrl, args)
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        try:
+            bench.run()
+        finally:
+            server.terminate()
+
+    if output:
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(commit=commit, time=time.strftime('%Y-%m-%d %H:%M:%S'), options=vars(args), results=bench.results),
+                               ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
-from aqt import mw
-from aqt.qt import *
+# 在Anki之外(如命令行)导入时不加载任何界面相关的模块
+try:
+    from aqt import mw
+except ImportError:
+    mw = None
 
-from .addonWindow import Windows
+if mw is not None:
+    from aqt.qt import *
 
-def showWindow():
-    w = Windows()
-    w.exec()
+    from .addonWindow import Windows
 
-action = QAction("shanbay2anki", mw)
-action.triggered.connect(showWindow)
-mw.form.menuTools.addAction(action)
+    def showWindow():
+        w = Windows()
+        w.exec()
+
+    action = QAction("shanbay2anki", mw)
+    action.triggered.connect(showWindow)
+    mw.form.menuTools.addAction(action)
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+import multiprocessing
+from threading import Event
+
+from .shanbayAPI import ShanbayAPI
+from .scheduler import SyncScheduler
+from .progress import ProgressReporter, formatProgress
+from .exporter import exportWordBook
+from .audioStore import AudioStore
+from .netStats import stats as netStats
+from .archive import rederive as rederiveWords
+from .profiles import DEFAULT_PROFILE, profileNames, profileConfig, databaseName, statsPath
+
+logger = logging.getLogger(__package__ + '.cli')
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def loadConfig(path=None):
+    # 默认配置来自config.json，Anki保存的用户配置在meta.json的config中
+    with open(os.path.join(ADDON_DIR, 'config.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    metaPath = os.path.join(ADDON_DIR, 'meta.json')
+    if os.path.exists(metaPath):
+        with open(metaPath, encoding='utf-8') as f:
+            config.update(json.load(f).get('config', {}))
+    if path is not None:
+        with open(path, encoding='utf-8') as f:
+            config.update(json.load(f))
+    return config
+
+
+def setupLogging(verbose, levels, profile=DEFAULT_PROFILE):
+    name = f' [{profile}]' if profile != DEFAULT_PROFILE else ''
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO,
+                        format=f'%(asctime)s %(levelname)s{name} %(name)s: %(message)s', force=True)
+    logging.getLogger(__package__ + '.sql').setLevel(levels.get('sql', 'INFO'))
+    logging.getLogger('urllib3').setLevel(levels.get('http', 'INFO'))
+
+
+def profilesOf(args, config):
+    if getattr(args, 'all_profiles', False):
+        return profileNames(config)
+    return args.profile or [DEFAULT_PROFILE]
+
+
+def sync(args, config):
+    profiles = profilesOf(args, config)
+    try:
+        for profile in profiles:
+            profileConfig(config, profile)
+    except (KeyError, ValueError) as e:
+        logger.error(e.args[0])
+        return 2
+    if not profiles:
+        logger.error('配置中没有任何配置档')
+        return 2
+    if len(profiles) == 1:
+        return syncProfile(args, config, profiles[0])
+    # 多个账户在各自的进程中同步，互不影响；Ctrl+C由子进程各自处理，中断后下次从中断的位置继续
+    # 用python -m运行时本模块是__main__，spawn出的子进程找不到其中的函数，要按包内的模块名引用
+    from . import __main__ as cli
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    context = multiprocessing.get_context('spawn')
+    options = argparse.Namespace(**{k: v for k, v in vars(args).items() if k != 'run'})
+    processes = {profile: context.Process(target=cli.runProfile, args=(options, config, profile), name=profile) for profile in profiles}
+    for process in processes.values():
+        process.start()
+    results = {}
+    for profile, process in processes.items():
+        process.join()
+        results[profile] = process.exitcode
+    logger.info('各账户同步结果: ' + ', '.join(f"{profile}={'成功' if code == 0 else f'失败({code})'}" for profile, code in results.items()))
+    return max(code if code >= 0 else 1 for code in results.values())
+
+
+def runProfile(args, config, profile):
+    setupLogging(args.verbose, config.get('logLevels', {}), profile)
+    sys.exit(syncProfile(args, config, profile))
+
+
+def syncProfile(args, config, profile):
+    config = profileConfig(config, profile)
+    api = ShanbayAPI(config.get('cacheSize', 64), profile)
+    if not api.checkCookie(json.loads(config['cookie'])):
+        logger.error('Cookie失效，请先在Anki中登录扇贝，或在配置档中填写cookie')
+        return 2
+
+    translate = config['translate']
+    try:
+        from .bays import convert
+    except ModuleNotFoundError:
+        translate = False
+
+    interrupted = Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: interrupted.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: interrupted.set())
+
+    scheduler = SyncScheduler(
+        api,
+        concurrency=args.concurrency or config.get('concurrency', 1),
+        incremental=config.get('incremental', False) and not args.full,
+        batchSize=config.get('batchSize', 100),
+        example=config['example'],
+        translate=translate,
+    )
+    progress = ProgressReporter(lambda *update: logger.info(formatProgress(*update)), interval=args.interval)
+    scheduler.isInterrupted = interrupted.is_set
+    scheduler.onTick = progress.advance
+    scheduler.onTotal = progress.setTotal
+    finished = scheduler.run(api.getWordNumber())
+    progress.finish()
+    api.cache.logStats()
+    netStats.dump(statsPath(profile))
+    if not finished:
+        logger.warning('同步被中断，下次从中断的位置继续')
+        return 1
+    logger.info('同步完成')
+    return 0
+
+
+def rederive(args, config):
+    profile = singleProfile(args)
+    try:
+        config = profileConfig(config, profile)
+    except (KeyError, ValueError) as e:
+        logger.error(e.args[0])
+        return 2
+    api = ShanbayAPI(config.get('cacheSize', 64), profile)
+    interrupted = Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: interrupted.set())
+    progress = ProgressReporter(lambda *update: logger.info(formatProgress(*update)), interval=args.interval)
+    progress.setTotal(api.countPayloads('word') + api.countPayloads('examples'))
+    finished = rederiveWords(api, args.concurrency or config.get('concurrency', 1), config.get('batchSize', 100), interrupted.is_set, progress.advance)
+    progress.finish()
+    if not finished:
+        logger.warning('重新生成被中断')
+        return 1
+    logger.info('已从存档重新生成单词')
+    return 0
+
+
+def singleProfile(args):
+    if args.profile and len(args.profile) > 1:
+        raise SystemExit('这个命令只能指定一个配置档')
+    return args.profile[0] if args.profile else DEFAULT_PROFILE
+
+
+def export(args, config):
+    profile = singleProfile(args)
+    try:
+        config = profileConfig(config, profile)
+    except (KeyError, ValueError) as e:
+        logger.error(e.args[0])
+        return 2
+    api = ShanbayAPI(config.get('cacheSize', 64), profile)
+    books = args.book or [name for name, _ in api.getAllBooks()]
+    audioStore = AudioStore(databaseName(profile), '.') if args.download_audio else None
+    exportWordBook(api, args.output, books, config, args.deck or config.get('deck') or None, '.', audioStore)
+    if audioStore is not None:
+        audioStore.logStats()
+        netStats.dump(statsPath(profile))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='shanbay2anki', description='不启动Anki同步扇贝单词')
+    parser.add_argument('--dir', default='.', help='shanbay2anki.db所在的目录，一般是Anki的媒体文件夹')
+    parser.add_argument('--config', help='额外的配置文件，覆盖插件配置')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出调试日志')
+    parser.add_argument('--profile', action='append', help='使用配置中profiles下的账户，sync可以重复指定，多个账户并行同步')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    syncParser = commands.add_parser('sync', help='同步单词、例句和翻译到数据库')
+    syncParser.add_argument('--full', action='store_true', help='忽略上次同步的位置，全量同步')
+    syncParser.add_argument('--concurrency', type=int, help='并发请求数')
+    syncParser.add_argument('--interval', type=float, default=5.0, help='输出进度的间隔(秒)')
+    syncParser.add_argument('--all-profiles', action='store_true', help='并行同步配置中的所有账户')
+    syncParser.set_defaults(run=sync)
+
+    rederiveParser = commands.add_parser('rederive', help='用存档的接口原始内容重新生成数据库中的单词，不联网')
+    rederiveParser.add_argument('--concurrency', type=int, help='并行解析的线程数')
+    rederiveParser.add_argument('--interval', type=float, default=5.0, help='输出进度的间隔(秒)')
+    rederiveParser.set_defaults(run=rederive)
+
+    exportParser = commands.add_parser('export', help='把数据库中的单词导出为.apkg/.csv/.tsv')
+    exportParser.add_argument('output', help='输出文件，按扩展名决定格式')
+    exportParser.add_argument('--book', action='append', help='要导出的书(中文名)，可以重复，默认导出全部')
+    exportParser.add_argument('--deck', help='.apkg中的牌组名')
+    exportParser.add_argument('--download-audio', action='store_true', help='下载媒体文件夹中缺少的发音并打包进.apkg')
+    exportParser.set_defaults(run=export)
+
+    args = parser.parse_args(argv)
+    config = loadConfig(args.config)
+    setupLogging(args.verbose, config.get('logLevels', {}))
+    # 输出文件相对于执行命令的目录，而不是--dir
+    if getattr(args, 'output', None):
+        args.output = os.path.abspath(args.output)
+    os.chdir(args.dir)
+    return args.run(args, config)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
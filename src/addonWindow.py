@@ -8,10 +8,14 @@ import logging
 
 from .UIForm import mainUI
 from .workers import *
-from .noteManager import getDeckList
+from .noteManager import getDeckList, refreshCollection
 from .loginDialog import LoginDialog
 from .shanbayAPI import ShanbayAPI
-from .logger import Handler
+from .audioStore import AudioStore
+from .progress import formatProgress
+from .netStats import stats as netStats
+from .profiles import statsPath
+from .logger import Handler, setupLogging, stopLogging
 
 logger = logging.getLogger(__name__)
 
@@ -24,12 +28,14 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.cookie = "{}"
         self.workerThread = QThread(self)
         self.wordDownloadThread = QThread(self)
-        self.audioDownloadThread = QThread(self)
-        self.api = ShanbayAPI()
+        self.deckBuildThread = QThread(self)
 
         self.setupUi(self)
         self.setWindowTitle("shanbay2anki")
         self.setupLogger()
+        self.setupStatsTab()
+        self.api = ShanbayAPI(mw.addonManager.getConfig(__name__).get('cacheSize', 64))
+        self.audioStore = AudioStore('shanbay2anki.db', mw.col.media.dir())
         self.setupGUIByConfig()
         self.initItem()
 
@@ -44,28 +50,44 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             self.wordDownloadThread.quit()
             self.wordDownloadThread.wait()
 
-        if self.audioDownloadThread.isRunning():
-            self.audioDownloadThread.requestInterruption()
-            self.audioDownloadThread.quit()
-            self.audioDownloadThread.wait()
+        if self.deckBuildThread.isRunning():
+            self.deckBuildThread.requestInterruption()
+            self.deckBuildThread.quit()
+            self.deckBuildThread.wait()
 
         event.accept()
 
     def setupLogger(self):
 
-        def onDestroyed():
-            logger.removeHandler(QtHandler)
-
-        logging.basicConfig(handlers=[logging.FileHandler('shanbay2anki.log', 'w', 'utf-8')], level=logging.DEBUG)
-
+        config = mw.addonManager.getConfig(__name__)
         logTextBox = QPlainTextEdit(self)
+        logTextBox.setReadOnly(True)
+        logTextBox.setMaximumBlockCount(config.get('logLines', 2000))
         layout = QVBoxLayout()
         layout.addWidget(logTextBox)
         self.logTab.setLayout(layout)
-        QtHandler = Handler(self)
-        logger.addHandler(QtHandler)
-        QtHandler.newRecord.connect(logTextBox.appendPlainText)
-        logTextBox.destroyed.connect(onDestroyed)
+        setupLogging(config, Handler(self, logTextBox))
+        logTextBox.destroyed.connect(stopLogging)
+
+    def setupStatsTab(self):
+        statsTab = QWidget()
+        self.statsTextBox = QPlainTextEdit(statsTab)
+        self.statsTextBox.setReadOnly(True)
+        self.statsTextBox.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.statsTextBox.setStyleSheet('font-family: monospace')
+        layout = QVBoxLayout()
+        layout.addWidget(self.statsTextBox)
+        statsTab.setLayout(layout)
+        self.tabWidget.addTab(statsTab, '统计')
+
+        def refresh():
+            if self.tabWidget.currentWidget() is statsTab:
+                self.statsTextBox.setPlainText(netStats.format())
+
+        self.statsTimer = QTimer(self)
+        self.statsTimer.timeout.connect(refresh)
+        self.statsTimer.start(1000)
+        self.tabWidget.currentChanged.connect(refresh)
 
     def setupGUIByConfig(self):
         config = mw.addonManager.getConfig(__name__)
@@ -93,10 +115,11 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.deckComboBox.addItems(getDeckList())
 
         self.bookListWidget.clear()
-        for bookName in self.api.getAllBooks():
+        for bookName, wordCount in self.api.getAllBooks():
             item = QListWidgetItem()
             item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-            item.setText(bookName)
+            item.setText(f'{bookName} ({wordCount})')
+            item.setData(Qt.UserRole, bookName)
             item.setCheckState(Qt.Unchecked)
             self.bookListWidget.addItem(item)
 
@@ -106,7 +129,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             self.createBtn.setEnabled(False)
 
     def saveCurrentConfig(self) -> dict:
-        currentConfig = dict(
+        currentConfig = mw.addonManager.getConfig(__name__)
+        currentConfig.update(
             deck=self.deckComboBox.currentText(),
             example=self.exampleCheckBox.isChecked(),
             translate=self.translateCheckBox.isChecked(),
@@ -164,77 +188,77 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.downloadWord()
 
     def downloadWord(self):
+        netStats.reset()
         self.wordDownloadThread.start()
-        self.wordDownloadWorker = WordDownloadWorker(self.api)
-        self.wordDownloadWorker.moveToThread(self.wordDownloadThread)
+        self.syncWorker = SyncWorker(self.api, self.config)
+        self.syncWorker.moveToThread(self.wordDownloadThread)
         self.progressBar.setTextVisible(True)
         self.progressBar.setValue(0)
-        self.progressBar.setMaximum(self.api.getWordNumber())
-        self.wordDownloadWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
-        self.wordDownloadWorker.start.connect(self.wordDownloadWorker.run)
-        self.wordDownloadWorker.done.connect(lambda: tooltip(f'单词下载完成'))
-        self.wordDownloadWorker.done.connect(self.initItem)
-        self.wordDownloadWorker.done.connect(self.downloadWordExample)
-        self.wordDownloadWorker.start.emit()
-
-    def downloadWordExample(self):
-        if not self.config['example']:
-            self.downloadSentenceTranslate()
-            return
-        self.wordExampleDownloadWorker = WordExampleDownloadWorker(self.api)
-        self.wordExampleDownloadWorker.moveToThread(self.wordDownloadThread)
-        self.progressBar.setValue(0)
-        self.progressBar.setMaximum(len(self.api.getWordsWithoutExample()))
-        self.wordExampleDownloadWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
-        self.wordExampleDownloadWorker.start.connect(self.wordExampleDownloadWorker.run)
-        self.wordExampleDownloadWorker.done.connect(lambda: tooltip(f'例句下载完成'))
-        self.wordExampleDownloadWorker.done.connect(self.downloadSentenceTranslate)
-        self.wordExampleDownloadWorker.start.emit()
-
-    def downloadSentenceTranslate(self):
-        if not self.config['translate']:
-            self.downloadFinish()
-            return
-        self.SentenceTranslateDownloadWorker = SentenceTranslateDownloadWorker(self.api)
-        self.SentenceTranslateDownloadWorker.moveToThread(self.wordDownloadThread)
-        self.progressBar.setValue(0)
-        self.progressBar.setMaximum(len(self.api.getSentencesWithoutTranslate()))
-        self.SentenceTranslateDownloadWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
-        self.SentenceTranslateDownloadWorker.start.connect(self.SentenceTranslateDownloadWorker.run)
-        self.SentenceTranslateDownloadWorker.done.connect(lambda: tooltip(f'翻译下载完成'))
-        self.SentenceTranslateDownloadWorker.done.connect(self.downloadFinish)
-        self.SentenceTranslateDownloadWorker.start.emit()
+        self.progressBar.setMaximum(0)
+        self.syncWorker.progress.connect(self.updateProgress)
+        self.syncWorker.start.connect(self.syncWorker.run)
+        self.syncWorker.done.connect(lambda: tooltip(f'同步完成'))
+        self.syncWorker.done.connect(self.initItem)
+        self.syncWorker.finished.connect(self.downloadFinish)
+        self.syncWorker.start.emit()
+
+    @pyqtSlot(int, int, float, float)
+    def updateProgress(self, done, total, rate, eta):
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(min(done, total))
+        self.progressBar.setFormat(formatProgress(done, total, rate, eta))
 
     def downloadFinish(self):
+        self.api.cache.logStats()
+        netStats.dump(statsPath())
         self.progressBar.setMaximum(1)
+        self.progressBar.setFormat('%v/%m')
         self.progressBar.setTextVisible(False)
         self.mainTab.setEnabled(True)
         self.wordDownloadThread.quit()
 
     @pyqtSlot()
     def on_createBtn_clicked(self):
+        # 创建过程中按钮用来取消，已经提交的单词会保留在牌组中
+        if self.deckBuildThread.isRunning():
+            self.deckBuildThread.requestInterruption()
+            self.createBtn.setEnabled(False)
+            return
         self.saveCurrentConfig()
 
-        selectedBooks = [self.bookListWidget.item(index).text() for index in range(self.bookListWidget.count()) if
+        selectedBooks = [self.bookListWidget.item(index).data(Qt.UserRole) for index in range(self.bookListWidget.count()) if
                          self.bookListWidget.item(index).checkState() == Qt.Checked]
         deckName = self.deckComboBox.currentText()
-        audiosDownloadTasks = []
-        self.api.createWordBook(deckName, selectedBooks, self.config, audiosDownloadTasks)
-        showInfo("创建单词书成功！")
-
-        if audiosDownloadTasks:
-            self.progressBar.setValue(0)
-            self.progressBar.setMaximum(len(audiosDownloadTasks))
-            if self.audioDownloadThread is not None:
-                self.audioDownloadThread.requestInterruption()
-                self.audioDownloadThread.quit()
-                self.audioDownloadThread.wait()
-
-            self.audioDownloadThread.start()
-            self.audioDownloadWorker = AudioDownloadWorker(audiosDownloadTasks)
-            self.audioDownloadWorker.moveToThread(self.audioDownloadThread)
-            self.audioDownloadWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
-            self.audioDownloadWorker.start.connect(self.audioDownloadWorker.run)
-            self.audioDownloadWorker.done.connect(lambda: tooltip(f'发音下载完成'))
-            self.audioDownloadWorker.done.connect(self.audioDownloadThread.quit)
-            self.audioDownloadWorker.start.emit()
+        netStats.reset()
+        self.pullRemoteWordsBtn.setEnabled(False)
+        self.createBtn.setText('取消')
+        self.progressBar.setTextVisible(True)
+        self.progressBar.setValue(0)
+        self.progressBar.setMaximum(0)
+
+        self.deckBuildThread.start()
+        self.deckBuildWorker = DeckBuildWorker(self.api, self.audioStore, deckName, selectedBooks, self.config)
+        self.deckBuildWorker.moveToThread(self.deckBuildThread)
+        self.deckBuildWorker.progress.connect(self.updateProgress)
+        self.deckBuildWorker.start.connect(self.deckBuildWorker.run)
+        self.deckBuildWorker.done.connect(self.deckBuildFinish)
+        self.deckBuildWorker.start.emit()
+
+    @pyqtSlot(dict)
+    def deckBuildFinish(self, stats):
+        self.deckBuildThread.quit()
+        self.deckBuildThread.wait()
+        if stats['added'] or stats['updated'] or not stats['finished']:
+            refreshCollection()
+        netStats.dump(statsPath())
+        self.progressBar.setMaximum(1)
+        self.progressBar.setFormat('%v/%m')
+        self.progressBar.setTextVisible(False)
+        self.createBtn.setText('创建单词书')
+        self.createBtn.setEnabled(True)
+        self.pullRemoteWordsBtn.setEnabled(True)
+        message = f"新增{stats['added']}个单词，更新{stats['updated']}个，{stats['skipped']}个没有变化"
+        if stats['finished']:
+            showInfo(f'创建单词书成功！{message}，发音下载完成')
+        else:
+            tooltip(f'已取消创建单词书，{message}')
@@ -0,0 +1,74 @@
+import json
+import zlib
+import logging
+from collections import deque
+
+from .misc import Executor
+
+logger = logging.getLogger(__name__)
+
+
+def pack(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def deriveWord(api, word, blob):
+    return api.parseWord(word, unpack(blob))
+
+
+def deriveExamples(api, word, blob):
+    return word, api.parseExamples(word, unpack(blob)), None
+
+
+def rederiveEndpoint(api, executor, window, endpoint, derive, save, batchSize, isInterrupted, onTick):
+    # 解压和解析在线程池中进行，结果按单词id的顺序在当前线程中批量写库
+    batch = []
+    pending = deque()
+    counts = dict(done=0, failed=0)
+
+    def collect(word, future):
+        try:
+            batch.append(future.result())
+            counts['done'] += 1
+        except Exception as e:
+            counts['failed'] += 1
+            logger.warning(f'无法从存档重新生成{endpoint} {word}: {e}')
+        onTick()
+        if len(batch) >= batchSize:
+            save(batch)
+            batch.clear()
+
+    finished = True
+    try:
+        for word, blob in api.iterPayloads(endpoint):
+            if isInterrupted():
+                finished = False
+                break
+            pending.append((word, executor.submit(derive, api, word, blob)))
+            if len(pending) >= window:
+                collect(*pending.popleft())
+        while pending and finished:
+            collect(*pending.popleft())
+    finally:
+        if batch:
+            save(batch)
+    logger.info(f"从存档重新生成{endpoint}: 成功{counts['done']}个，失败{counts['failed']}个")
+    return finished
+
+
+def rederive(api, concurrency=1, batchSize=100, isInterrupted=lambda: False, onTick=lambda: None):
+    # 用存档的原始内容重新生成单词、来源和例句，不发出任何请求；没有存档的单词保持不变
+    api.offline = True
+    try:
+        with Executor(concurrency, name='rederive') as executor:
+            try:
+                return (rederiveEndpoint(api, executor, concurrency * 2, 'word', deriveWord, api.saveWords, batchSize, isInterrupted, onTick) and
+                        rederiveEndpoint(api, executor, concurrency * 2, 'examples', deriveExamples, api.saveWordExamples, batchSize, isInterrupted, onTick))
+            finally:
+                executor.cancel()
+    finally:
+        api.offline = False
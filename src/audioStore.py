@@ -0,0 +1,159 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import requests
+from threading import Lock
+from urllib3 import Retry
+from requests.adapters import HTTPAdapter
+
+from .netStats import stats as netStats
+
+logger = logging.getLogger(__name__)
+
+
+class AudioStore:
+    # 发音文件直接保存在Anki的媒体文件夹中，数据库记录每个URL对应的文件和大小，内容哈希只用来发现内容相同的文件
+    # 文件存在且大小一致时不再访问网络；下载到一半的.part文件用Range请求续传，完成后原子改名
+    retries = Retry(total=5, backoff_factor=3, status_forcelist=[500, 502, 503, 504])
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(max_retries=retries))
+    session.mount('https://', HTTPAdapter(max_retries=retries))
+    netStats.install(session, 'audio')
+    timeout = 30
+    chunkSize = 64 * 1024
+
+    def __init__(self, path, mediaDir):
+        self.mediaDir = mediaDir
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS audios (
+                             url TEXT PRIMARY KEY, file_name TEXT, sha1 TEXT, size INTEGER,
+                             etag TEXT, last_modified TEXT, fetched_at REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS audios_sha1 ON audios (sha1)')
+        # 开始写.part文件时记下响应的ETag/Last-Modified，续传时用If-Range保证服务器上的文件没有变
+        self.conn.execute('CREATE TABLE IF NOT EXISTS audio_parts (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)')
+        self.conn.commit()
+        self.stats = dict(skipped=0, verified=0, resumed=0, downloaded=0, failed=0)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def pathOf(self, fileName):
+        return os.path.join(self.mediaDir, fileName)
+
+    def lookup(self, url):
+        with self.lock:
+            return self.conn.execute('SELECT file_name, sha1, size, etag, last_modified FROM audios WHERE url = ?', (url,)).fetchone()
+
+    def isPresent(self, fileName, url):
+        entry = self.lookup(url)
+        filePath = self.pathOf(fileName)
+        return entry is not None and entry[0] == fileName and os.path.exists(filePath) and os.path.getsize(filePath) == entry[2]
+
+    def missing(self, tasks):
+        # 去掉重复的URL和已经下载好的文件，返回还需要处理的 (文件名, URL)
+        pending = {}
+        for fileName, url in tasks:
+            if url not in pending and not self.isPresent(fileName, url):
+                pending[url] = fileName
+        self.count('skipped', len({url for _, url in tasks}) - len(pending))
+        return [(fileName, url) for url, fileName in pending.items()]
+
+    def partValidators(self, url):
+        with self.lock:
+            return self.conn.execute('SELECT etag, last_modified FROM audio_parts WHERE url = ?', (url,)).fetchone() or (None, None)
+
+    def startPart(self, url, etag, lastModified):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO audio_parts (url, etag, last_modified) VALUES (?, ?, ?)', (url, etag, lastModified))
+
+    def dropPart(self, url, partPath):
+        if os.path.exists(partPath):
+            os.remove(partPath)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM audio_parts WHERE url = ?', (url,))
+
+    def record(self, fileName, url, filePath, etag=None, lastModified=None):
+        sha1 = hashlib.sha1()
+        with open(filePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunkSize), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        size = os.path.getsize(filePath)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO audios (url, file_name, sha1, size, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, fileName, digest, size, etag, lastModified, time.time()))
+            self.conn.execute('DELETE FROM audio_parts WHERE url = ?', (url,))
+            same = self.conn.execute('SELECT count(*) FROM audios WHERE sha1 = ? AND url != ?', (digest, url)).fetchone()[0]
+        if same:
+            logger.debug(f'{fileName} 与已有的{same}个发音文件内容相同')
+        return digest
+
+    def download(self, fileName, url, isCancelled=lambda: False):
+        filePath = self.pathOf(fileName)
+        partPath = filePath + '.part'
+        entry = self.lookup(url)
+
+        # 文件已存在但没有记录(旧版本下载的)，用HEAD确认大小后直接登记
+        if os.path.exists(filePath) and (entry is None or entry[0] != fileName):
+            r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+            if r.status_code == 200 and r.headers.get('Content-Length') == str(os.path.getsize(filePath)):
+                self.record(fileName, url, filePath, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+                self.count('verified')
+                logger.info(f'{fileName} 已存在，跳过下载')
+                return
+
+        # 不知道.part文件对应哪个版本时不能续传，否则可能把两个版本拼在一起
+        headers = {}
+        offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+        etag, lastModified = self.partValidators(url) if offset else (None, None)
+        if etag or lastModified:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = etag or lastModified
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416 and 'Range' in headers:
+                # .part不短于服务器上的文件：长度相等说明写完后没来得及改名，否则丢掉重新下载
+                if r.headers.get('Content-Range', '').rpartition('/')[2] != str(offset):
+                    logger.info(f'{fileName} 未完成的部分与服务器上的文件不一致，重新下载')
+                    self.dropPart(url, partPath)
+                    restart = True
+                else:
+                    restart = False
+                resumed, expected = True, None
+            elif r.status_code not in (200, 206):
+                self.count('failed')
+                logger.warning(f'下载{fileName}:{url}失败，状态码{r.status_code}')
+                return
+            else:
+                restart = False
+                resumed = r.status_code == 206
+                expected = r.headers.get('Content-Length')
+                etag, lastModified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+                if not resumed:
+                    offset = 0
+                    self.startPart(url, etag, lastModified)
+                with open(partPath, 'ab' if resumed else 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=self.chunkSize):
+                        if isCancelled():
+                            logger.info(f'{fileName} 下载已取消，下次继续')
+                            return
+                        if chunk:
+                            f.write(chunk)
+
+        if restart:
+            return self.download(fileName, url, isCancelled)
+        if expected is not None and os.path.getsize(partPath) != offset + int(expected):
+            self.count('failed')
+            logger.warning(f'{fileName} 下载不完整，下次继续')
+            return
+        os.replace(partPath, filePath)
+        self.record(fileName, url, filePath, etag, lastModified)
+        self.count('resumed' if resumed else 'downloaded')
+        logger.info(f'{fileName} {"续传" if resumed else "下载"}完成')
+
+    def logStats(self):
+        logger.info('发音文件：跳过{skipped}个，确认{verified}个，续传{resumed}个，下载{downloaded}个，失败{failed}个'.format(**self.stats))
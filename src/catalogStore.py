@@ -0,0 +1,47 @@
+import sqlite3
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogStore:
+    # 书籍目录(书名、章节名)持久化在数据库中，内存中保留一份副本，可以在多个线程中使用
+    def __init__(self, path):
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.books = {}
+        self.chapters = {}
+        for code, nameCN, nameEN in self.conn.execute('SELECT code, name_cn, name_en FROM catalog_books'):
+            self.books[code] = {'cn': nameCN, 'en': nameEN}
+        for code, chapterID, titleCN, titleEN in self.conn.execute('SELECT code, id, title_cn, title_en FROM catalog_chapters'):
+            self.chapters[code] = {'cn': titleCN, 'en': titleEN, 'id': chapterID}
+
+    def getBook(self, code):
+        return self.books.get(code)
+
+    def getChapter(self, code):
+        return self.chapters.get(code)
+
+    def saveBook(self, code, nameCN, nameEN):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO catalog_books (code, name_cn, name_en) VALUES (?, ?, ?)', (code, nameCN, nameEN))
+            self.books[code] = {'cn': nameCN, 'en': nameEN}
+
+    def saveChapter(self, code, chapterID, titleCN, titleEN, bookCode):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO catalog_chapters (code, id, book_code, title_cn, title_en) VALUES (?, ?, ?, ?, ?)',
+                              (code, chapterID, bookCode, titleCN, titleEN))
+            self.chapters[code] = {'cn': titleCN, 'en': titleEN, 'id': chapterID}
+
+    def saveCatalogs(self, code, catalogs):
+        chapters = [(c['id'], c['id'], code, c['title_cn'], c['title_en']) for c in catalogs['catalogs']]
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO catalog_books (code, name_cn, name_en) VALUES (?, ?, ?)',
+                              (code, catalogs['book']['name_cn'], catalogs['book']['name_en']))
+            self.conn.executemany('INSERT OR REPLACE INTO catalog_chapters (code, id, book_code, title_cn, title_en) VALUES (?, ?, ?, ?, ?)', chapters)
+            # 先登记书名，其他线程看到章节时书名一定已经存在
+            self.books[code] = {'cn': catalogs['book']['name_cn'], 'en': catalogs['book']['name_en']}
+            for chapterCode, chapterID, _, titleCN, titleEN in chapters:
+                self.chapters[chapterCode] = {'cn': titleCN, 'en': titleEN, 'id': chapterID}
+        logger.info(f"保存《{catalogs['book']['name_cn']}》的目录，共{len(chapters)}章")
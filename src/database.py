@@ -0,0 +1,122 @@
+import logging
+
+from .constants import DB_FIELDS, SOURCE_FIELDS, NEWS_BOOK_NAME
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS words ({}, examples_fetched INTEGER NOT NULL DEFAULT 0)'.format(
+        ','.join(c + (' TEXT PRIMARY KEY' if c == 'id' else ' TEXT') for c in DB_FIELDS)),
+    '''CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        type TEXT NOT NULL,
+        code TEXT,
+        name_cn TEXT,
+        name_en TEXT,
+        word_count INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (type, name_cn))''',
+    'CREATE TABLE IF NOT EXISTS sources ({}, PRIMARY KEY (word_id, idx))'.format(
+        ','.join(c + (' INTEGER' if c in ('idx', 'book_id') else ' TEXT') for c in SOURCE_FIELDS)),
+    'CREATE INDEX IF NOT EXISTS sources_book ON sources (book_id, word_id)',
+    'CREATE TABLE IF NOT EXISTS examples (word_id TEXT, idx INTEGER, en TEXT, cn TEXT, PRIMARY KEY (word_id, idx))',
+    'CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)',
+    # 原句翻译按扇贝的句子id保存，多个单词来自同一句时只下载一次
+    'CREATE TABLE IF NOT EXISTS translations (sentence TEXT PRIMARY KEY, article TEXT, translate TEXT)',
+    'CREATE INDEX IF NOT EXISTS sources_sentence ON sources (sentence)',
+    # 单词详情和例句接口返回的原始JSON(zlib压缩)，解析规则变化时据此重新生成，不必重新下载
+    'CREATE TABLE IF NOT EXISTS payloads (word_id TEXT, endpoint TEXT, data BLOB, fetched_at REAL, PRIMARY KEY (word_id, endpoint))',
+    'CREATE TABLE IF NOT EXISTS catalog_books (code TEXT PRIMARY KEY, name_cn TEXT, name_en TEXT)',
+    'CREATE TABLE IF NOT EXISTS catalog_chapters (code TEXT PRIMARY KEY, id TEXT, book_code TEXT, title_cn TEXT, title_en TEXT)',
+    # 牌组中每个扇贝单词对应的笔记及其字段指纹，用于增量更新牌组
+    'CREATE TABLE IF NOT EXISTS deck_notes (deck TEXT, word_id TEXT, note_id INTEGER, fingerprint TEXT, PRIMARY KEY (deck, word_id))',
+    # 每本书包含的单词及单词数，由下面的触发器随来源的写入同步维护
+    'CREATE TABLE IF NOT EXISTS book_words (book_id INTEGER, word_id TEXT, PRIMARY KEY (book_id, word_id)) WITHOUT ROWID',
+    '''CREATE TRIGGER IF NOT EXISTS sources_insert AFTER INSERT ON sources WHEN NEW.book_id IS NOT NULL BEGIN
+        INSERT INTO book_words (book_id, word_id) SELECT NEW.book_id, NEW.word_id
+            WHERE NOT EXISTS (SELECT 1 FROM book_words WHERE book_id = NEW.book_id AND word_id = NEW.word_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS sources_update AFTER UPDATE OF book_id ON sources WHEN OLD.book_id IS NOT NEW.book_id BEGIN
+        DELETE FROM book_words WHERE book_id = OLD.book_id AND word_id = OLD.word_id
+            AND NOT EXISTS (SELECT 1 FROM sources WHERE book_id = OLD.book_id AND word_id = OLD.word_id);
+        INSERT INTO book_words (book_id, word_id) SELECT NEW.book_id, NEW.word_id
+            WHERE NEW.book_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM book_words WHERE book_id = NEW.book_id AND word_id = NEW.word_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS sources_delete AFTER DELETE ON sources WHEN OLD.book_id IS NOT NULL BEGIN
+        DELETE FROM book_words WHERE book_id = OLD.book_id AND word_id = OLD.word_id
+            AND NOT EXISTS (SELECT 1 FROM sources WHERE book_id = OLD.book_id AND word_id = OLD.word_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_words_insert AFTER INSERT ON book_words BEGIN
+        UPDATE books SET word_count = word_count + 1 WHERE id = NEW.book_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_words_delete AFTER DELETE ON book_words BEGIN
+        UPDATE books SET word_count = word_count - 1 WHERE id = OLD.book_id;
+    END''',
+)
+
+
+def columnsOf(db, table):
+    db.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in db.fetchall()]
+
+
+def migrateLegacyWords(db):
+    # 旧版words表把来源和例句分别放在 source_*1/source_*2、examples1_*/examples2_* 列里
+    logger.info('迁移旧版数据库')
+    db.execute('ALTER TABLE words RENAME TO legacy_words')
+    db.execute('DROP INDEX IF EXISTS words_id')
+    for sql in SCHEMA:
+        db.execute(sql)
+    columns = ','.join(DB_FIELDS)
+    db.execute(f'INSERT OR IGNORE INTO words ({columns}, examples_fetched) SELECT {columns}, examples1_en IS NOT NULL FROM legacy_words')
+    for i in (1, 2):
+        db.execute(f"""INSERT OR IGNORE INTO books (type, name_cn, name_en)
+                       SELECT DISTINCT 'book', source_name_cn{i}, source_name_en{i} FROM legacy_words WHERE source_type{i} = 'book'""")
+        db.execute(f"""INSERT OR IGNORE INTO books (type, name_cn)
+                       SELECT DISTINCT 'news', ? FROM legacy_words WHERE source_type{i} = 'news'""", (NEWS_BOOK_NAME,))
+        db.execute(f"""INSERT OR IGNORE INTO sources ({','.join(SOURCE_FIELDS)})
+                       SELECT id, {i}, source_type{i},
+                              (SELECT books.id FROM books WHERE books.type = source_type{i} AND books.name_cn =
+                                  CASE source_type{i} WHEN 'news' THEN ? ELSE source_name_cn{i} END),
+                              source_article{i}, source_paragraph{i}, source_sentence{i}, source_content{i},
+                              CASE source_type{i} WHEN 'news' THEN source_name_en{i} END, source_title_cn{i}, source_title_en{i}
+                       FROM legacy_words WHERE source_content{i} IS NOT NULL""", (NEWS_BOOK_NAME,))
+        db.execute(f"""INSERT OR IGNORE INTO translations (sentence, article, translate)
+                       SELECT source_sentence{i}, source_article{i}, source_translate{i} FROM legacy_words
+                       WHERE source_sentence{i} IS NOT NULL AND source_translate{i} IS NOT NULL""")
+        db.execute(f"""INSERT OR IGNORE INTO examples (word_id, idx, en, cn)
+                       SELECT id, {i}, examples{i}_en, examples{i}_cn FROM legacy_words WHERE examples{i}_en != ''""")
+    db.execute('SELECT count(*) FROM translations')
+    logger.info(f'迁移了{db.fetchone()[0]}条原句翻译')
+    db.execute('DROP TABLE legacy_words')
+
+
+def rebuildBookWords(db):
+    logger.info('重建书籍单词索引')
+    db.execute('DELETE FROM book_words')
+    db.execute('INSERT OR IGNORE INTO book_words (book_id, word_id) SELECT book_id, word_id FROM sources WHERE book_id IS NOT NULL')
+    db.execute('UPDATE books SET word_count = (SELECT count(*) FROM book_words WHERE book_words.book_id = books.id)')
+
+
+def setupDatabase(conn):
+    db = conn.cursor()
+    # 必须在建表之前判断，旧版数据库的翻译在迁移时复制到translations表
+    hadTranslations = bool(columnsOf(db, 'translations'))
+    if 'source_type1' in columnsOf(db, 'words'):
+        with conn:
+            db.execute('BEGIN')
+            migrateLegacyWords(db)
+    books = columnsOf(db, 'books')
+    sources = columnsOf(db, 'sources')
+    with conn:
+        db.execute('BEGIN')
+        if books and 'word_count' not in books:
+            db.execute('ALTER TABLE books ADD COLUMN word_count INTEGER NOT NULL DEFAULT 0')
+        for sql in SCHEMA:
+            db.execute(sql)
+        if books and 'word_count' not in books:
+            rebuildBookWords(db)
+        if 'translate' in sources and not hadTranslations:
+            # 之前的翻译保存在sources.translate中，只在这里读取一次
+            db.execute('''INSERT OR IGNORE INTO translations (sentence, article, translate)
+                          SELECT sentence, article, translate FROM sources WHERE sentence IS NOT NULL AND translate IS NOT NULL''')
+    db.close()
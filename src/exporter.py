@@ -0,0 +1,193 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import zipfile
+import hashlib
+import logging
+import tempfile
+
+from .constants import MODEL_FIELDS
+from .profiles import DEFAULT_PROFILE
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'Shanbay'
+TEMPLATE_NAME = 'default'
+ANKI_SCHEMA = (
+    '''CREATE TABLE col (id INTEGER PRIMARY KEY, crt INTEGER NOT NULL, mod INTEGER NOT NULL, scm INTEGER NOT NULL,
+                         ver INTEGER NOT NULL, dty INTEGER NOT NULL, usn INTEGER NOT NULL, ls INTEGER NOT NULL,
+                         conf TEXT NOT NULL, models TEXT NOT NULL, decks TEXT NOT NULL, dconf TEXT NOT NULL, tags TEXT NOT NULL)''',
+    '''CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT NOT NULL, mid INTEGER NOT NULL, mod INTEGER NOT NULL,
+                           usn INTEGER NOT NULL, tags TEXT NOT NULL, flds TEXT NOT NULL, sfld INTEGER NOT NULL,
+                           csum INTEGER NOT NULL, flags INTEGER NOT NULL, data TEXT NOT NULL)''',
+    '''CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER NOT NULL, did INTEGER NOT NULL, ord INTEGER NOT NULL,
+                           mod INTEGER NOT NULL, usn INTEGER NOT NULL, type INTEGER NOT NULL, queue INTEGER NOT NULL,
+                           due INTEGER NOT NULL, ivl INTEGER NOT NULL, factor INTEGER NOT NULL, reps INTEGER NOT NULL,
+                           lapses INTEGER NOT NULL, left INTEGER NOT NULL, odue INTEGER NOT NULL, odid INTEGER NOT NULL,
+                           flags INTEGER NOT NULL, data TEXT NOT NULL)''',
+    '''CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER NOT NULL, usn INTEGER NOT NULL, ease INTEGER NOT NULL,
+                            ivl INTEGER NOT NULL, lastIvl INTEGER NOT NULL, factor INTEGER NOT NULL, time INTEGER NOT NULL,
+                            type INTEGER NOT NULL)''',
+    'CREATE TABLE graves (usn INTEGER NOT NULL, oid INTEGER NOT NULL, type INTEGER NOT NULL)',
+    'CREATE INDEX ix_notes_usn ON notes (usn)',
+    'CREATE INDEX ix_cards_usn ON cards (usn)',
+    'CREATE INDEX ix_revlog_usn ON revlog (usn)',
+    'CREATE INDEX ix_cards_nid ON cards (nid)',
+    'CREATE INDEX ix_cards_sched ON cards (did, queue, due)',
+    'CREATE INDEX ix_revlog_cid ON revlog (cid)',
+    'CREATE INDEX ix_notes_csum ON notes (csum)',
+)
+
+
+def stableId(*parts):
+    # 同一个牌组/单词每次导出得到相同的id，重复导入时Anki会更新而不是新建
+    digest = hashlib.sha1('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()
+    return int(digest[:12], 16) + 1
+
+
+def fieldsOf(word):
+    return [word.get(field) or '' for field in MODEL_FIELDS]
+
+
+def readTemplate(name):
+    with open(os.path.join(os.path.dirname(__file__), name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def exportText(words, path, delimiter, audios):
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(MODEL_FIELDS)
+        for _, word in words:
+            writer.writerow(fieldsOf(word))
+            audios.clear()
+            count += 1
+    return count
+
+
+class ApkgWriter:
+    # 笔记边生成边写入临时的collection.anki2，发音文件边遇到边写入zip，内存占用与单词数无关
+    def __init__(self, path, deckName, profile=DEFAULT_PROFILE, batchSize=1000):
+        self.path = path
+        self.deckName = deckName
+        self.profile = profile
+        self.batchSize = batchSize
+        self.now = int(time.time())
+        self.modelId = stableId('model', MODEL_NAME)
+        self.deckId = stableId('deck', deckName)
+        self.media = {}
+        self.mediaNames = set()
+        self.count = 0
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.colPath = os.path.join(self.tempDir.name, 'collection.anki2')
+        self.conn = sqlite3.connect(self.colPath)
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        for sql in ANKI_SCHEMA:
+            self.conn.execute(sql)
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self.notes = []
+        self.cards = []
+
+    def addMedia(self, fileName, filePath):
+        if fileName in self.mediaNames or not os.path.exists(filePath):
+            return
+        index = str(len(self.media))
+        # mp3已经是压缩过的，不再压缩
+        self.zip.write(filePath, index, zipfile.ZIP_STORED)
+        self.media[index] = fileName
+        self.mediaNames.add(fileName)
+
+    def noteKey(self, wordId):
+        # 不同账户的生词本可能有同一个单词，id和guid带上配置档，导入时才不会互相覆盖
+        return wordId if self.profile == DEFAULT_PROFILE else f'{self.profile}:{wordId}'
+
+    def addNote(self, wordId, word):
+        fields = fieldsOf(word)
+        key = self.noteKey(wordId)
+        noteId = stableId('note', key)
+        checksum = int(hashlib.sha1(fields[0].encode('utf-8')).hexdigest()[:8], 16)
+        self.notes.append((noteId, f'shanbay{key}', self.modelId, self.now, -1, '', '\x1f'.join(fields), fields[0], checksum, 0, ''))
+        self.cards.append((stableId('card', key), noteId, self.deckId, 0, self.now, -1, 0, 0, self.count + 1, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+        self.count += 1
+        if len(self.notes) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany('INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.notes)
+        self.conn.executemany('INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.cards)
+        self.conn.commit()
+        self.notes = []
+        self.cards = []
+
+    def model(self):
+        return {
+            'id': self.modelId, 'name': MODEL_NAME, 'type': 0, 'mod': self.now, 'usn': -1, 'sortf': 0,
+            'did': self.deckId, 'tags': [], 'vers': [], 'req': [[0, 'any', [0]]],
+            'css': readTemplate('styling.css'),
+            'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n'
+                        '\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n',
+            'latexPost': '\\end{document}',
+            'flds': [{'name': field, 'ord': i, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+                     for i, field in enumerate(MODEL_FIELDS)],
+            'tmpls': [{'name': TEMPLATE_NAME, 'ord': 0, 'qfmt': readTemplate('front.html'), 'afmt': readTemplate('back.html'),
+                       'did': None, 'bqfmt': '', 'bafmt': ''}],
+        }
+
+    def deck(self, deckId, name):
+        return {
+            'id': deckId, 'name': name, 'mod': self.now, 'usn': -1, 'desc': '', 'dyn': 0, 'conf': 1, 'collapsed': False,
+            'extendNew': 10, 'extendRev': 50, 'newToday': [0, 0], 'revToday': [0, 0], 'lrnToday': [0, 0], 'timeToday': [0, 0],
+        }
+
+    def close(self):
+        self.flush()
+        conf = {'nextPos': self.count + 1, 'curModel': self.modelId, 'curDeck': self.deckId, 'activeDecks': [self.deckId]}
+        dconf = {'1': {'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0,
+                       'replayq': True, 'dyn': False,
+                       'new': {'delays': [1, 10], 'ints': [1, 4, 7], 'initialFactor': 2500, 'order': 1, 'perDay': 20, 'bury': True},
+                       'rev': {'perDay': 200, 'ease4': 1.3, 'ivlFct': 1, 'maxIvl': 36500, 'bury': True, 'hardFactor': 1.2},
+                       'lapse': {'delays': [10], 'mult': 0, 'minInt': 1, 'leechFails': 8, 'leechAction': 0}}}
+        decks = {'1': self.deck(1, 'Default'), str(self.deckId): self.deck(self.deckId, self.deckName)}
+        self.conn.execute('INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, ?)',
+                          (self.now, self.now * 1000, self.now * 1000, json.dumps(conf),
+                           json.dumps({str(self.modelId): self.model()}), json.dumps(decks), json.dumps(dconf), '{}'))
+        self.conn.commit()
+        self.conn.close()
+        self.zip.write(self.colPath, 'collection.anki2')
+        self.zip.writestr('media', json.dumps(self.media))
+        self.zip.close()
+        self.tempDir.cleanup()
+
+
+def exportApkg(words, path, deckName, audios, mediaDir, audioStore=None, profile=DEFAULT_PROFILE):
+    writer = ApkgWriter(path, deckName, profile)
+    try:
+        for wordId, word in words:
+            writer.addNote(wordId, word)
+            # renderWord把本单词的发音放进audios，写入后清空，不在内存里积累
+            for fileName, url in audios:
+                if audioStore is not None and not audioStore.isPresent(fileName, url):
+                    audioStore.download(fileName, url)
+                writer.addMedia(fileName, os.path.join(mediaDir, fileName))
+            audios.clear()
+    finally:
+        writer.close()
+    logger.info(f'导出{writer.count}个单词，{len(writer.media)}个发音文件')
+    return writer.count
+
+
+def exportWordBook(api, path, selectedBooks, currentConfig, deckName=None, mediaDir='.', audioStore=None):
+    audios = []
+    words = api.iterWordBook(selectedBooks, currentConfig, audios)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.apkg':
+        return exportApkg(words, path, deckName or MODEL_NAME, audios, mediaDir, audioStore, api.profile)
+    if extension in ('.csv', '.tsv'):
+        count = exportText(words, path, '\t' if extension == '.tsv' else ',', audios)
+        logger.info(f'导出{count}个单词')
+        return count
+    raise ValueError(f'不支持的导出格式: {extension}')
@@ -1,18 +1,86 @@
 import logging
-from aqt.qt import pyqtSignal, QObject
+import logging.handlers
+from queue import SimpleQueue
+from threading import Lock
+from collections import deque
+from aqt.qt import QObject, QTimer
 
+# 可以单独设置日志级别的组件，对应的logger名称
+COMPONENTS = {
+    'sql': __package__ + '.sql',
+    'http': 'urllib3',
+}
+DEFAULT_LEVELS = {
+    'file': 'DEBUG',
+    'view': 'INFO',
+    'sql': 'INFO',
+    'http': 'INFO',
+}
+
+listener = None
+queueHandler = None
 
-class Handler(QObject, logging.Handler):
-    newRecord = pyqtSignal(object)
 
-    def __init__(self, parent):
+class Handler(QObject, logging.Handler):
+    # 日志记录先放入有界缓冲区，由GUI线程的定时器批量追加到文本框
+    def __init__(self, parent, textBox, interval=200):
         super().__init__(parent)
         super(logging.Handler).__init__()
 
         formatter = logging.Formatter('[%(asctime)s][%(name)s][%(levelname)s]\n%(message)s\n', '%d/%m/%Y %H:%M:%S')
         self.setFormatter(formatter)
         self.setLevel(logging.DEBUG)
+        self.textBox = textBox
+        self.pending = deque(maxlen=textBox.maximumBlockCount() or None)
+        self.pendingLock = Lock()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.appendPending)
+        self.timer.start(interval)
 
     def emit(self, record):
         msg = self.format(record)
-        self.newRecord.emit(msg)
\ No newline at end of file
+        with self.pendingLock:
+            self.pending.append(msg)
+
+    def appendPending(self):
+        with self.pendingLock:
+            if not self.pending:
+                return
+            msgs = list(self.pending)
+            self.pending.clear()
+        self.textBox.appendPlainText('\n'.join(msgs))
+
+
+def setupLogging(config, *handlers):
+    # 所有日志通过队列交给后台线程格式化和写入，业务线程只负责入队
+    global listener, queueHandler
+    stopLogging()
+    levels = {**DEFAULT_LEVELS, **config.get('logLevels', {})}
+    for component, name in COMPONENTS.items():
+        logging.getLogger(name).setLevel(levels[component])
+
+    fileHandler = logging.FileHandler('shanbay2anki.log', 'w', 'utf-8')
+    fileHandler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+    fileHandler.setLevel(levels['file'])
+    for handler in handlers:
+        handler.setLevel(levels['view'])
+
+    queue = SimpleQueue()
+    queueHandler = logging.handlers.QueueHandler(queue)
+    root = logging.getLogger()
+    root.addHandler(queueHandler)
+    root.setLevel(logging.DEBUG)
+    listener = logging.handlers.QueueListener(queue, fileHandler, *handlers, respect_handler_level=True)
+    listener.start()
+
+
+def stopLogging():
+    global listener, queueHandler
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+    if queueHandler is not None:
+        logging.getLogger().removeHandler(queueHandler)
+        queueHandler = None
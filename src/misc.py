@@ -1,48 +1,130 @@
+import time
 import logging
-from queue import Queue
-from threading import Thread
+from collections import Counter
+from threading import Event, Lock, Semaphore, Thread, local
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
 
 logger = logging.getLogger(__name__)
+current = local()
+NEVER = Event()
 
-class Worker(Thread):
-    def __init__(self, queue, result_queue):
-        super(Worker, self).__init__()
-        self._q = queue
-        self.result_queue = result_queue
-        self.daemon = True
-        self.start()
 
-    def run(self):
+def currentCancelEvent():
+    # Executor中的任务返回所属执行器的取消事件，等待重试等耗时操作应在它上面等待；其他线程中永远不会触发
+    return getattr(current, 'cancelled', None) or NEVER
+
+
+class Executor:
+    # 所有后台任务共用的线程池：提交时队列满了会阻塞(背压)，cancel()取消排队的任务，
+    # 正在执行的任务通过isCancelled()自行退出；统计每个任务的耗时和异常
+    def __init__(self, max_workers, max_queue=None, name='executor'):
+        self.name = name
+        self.cancelled = Event()
+        self.closed = Event()
+        self.lock = Lock()
+        self.slots = Semaphore(max_workers + (max_workers if max_queue is None else max_queue))
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.futures = set()
+        self.stats = dict(submitted=0, completed=0, failed=0, cancelled=0, elapsed=0.0, slowest=0.0)
+        self.errors = Counter()
+
+    def isCancelled(self):
+        return self.cancelled.is_set()
+
+    def submit(self, fn, *args, **kwargs):
+        while not self.slots.acquire(timeout=0.1):
+            if self.isCancelled():
+                break
+        else:
+            if not self.isCancelled():
+                future = self.pool.submit(self.call, fn, *args, **kwargs)
+                with self.lock:
+                    self.stats['submitted'] += 1
+                    self.futures.add(future)
+                future.add_done_callback(self.finish)
+                return future
+            self.slots.release()
+        # 已经取消的执行器不再接受任务，返回一个已取消的Future
+        future = Future()
+        future.cancel()
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        if self.isCancelled():
+            raise CancelledError()
+        start = time.perf_counter()
+        previous = getattr(current, 'cancelled', None)
+        current.cancelled = self.cancelled
+        try:
+            return fn(*args, **kwargs)
+        except CancelledError:
+            raise
+        except Exception as e:
+            with self.lock:
+                self.errors[f'{fn.__name__}: {type(e).__name__}'] += 1
+            raise
+        finally:
+            current.cancelled = previous
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stats['elapsed'] += elapsed
+                self.stats['slowest'] = max(self.stats['slowest'], elapsed)
+
+    def finish(self, future):
+        self.slots.release()
+        with self.lock:
+            self.futures.discard(future)
+            if future.cancelled() or isinstance(future.exception(), CancelledError):
+                self.stats['cancelled'] += 1
+            elif future.exception() is not None:
+                self.stats['failed'] += 1
+            else:
+                self.stats['completed'] += 1
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+    def cancelWhen(self, isInterrupted, interval=0.1):
+        # 在后台线程中检查是否被中断，调用方阻塞在future.result()上时也能立即取消
+        def watch():
+            while not self.isCancelled() and not self.closed.wait(interval):
+                if isInterrupted():
+                    self.cancel()
+        Thread(target=watch, name=f'{self.name}-watch', daemon=True).start()
+
+    def join(self, isInterrupted=lambda: False, interval=0.1):
+        # 等待所有任务完成，期间被中断则取消剩余任务，返回是否全部完成
         while True:
-            try:
-                f, args, kwargs = self._q.get()
-                result = f(*args, **kwargs)
-                if result:
-                    self.result_queue.put(result)
-            except Exception as e:
-                logger.exception(e)
-            finally:
-                self._q.task_done()
-
-class ThreadPool:
-    def __init__(self, max_workers):
-        self._q = Queue(max_workers)
-        self.results_q = Queue()
-        self.result = []
-        for _ in range(max_workers):
-            Worker(self._q, self.results_q)
-
-    def submit(self, f, *args, **kwargs):
-        self._q.put((f, args, kwargs))
-
-    def wait_complete(self):
-        self._q.join()
-        while not self.results_q.empty():
-            self.result.append(self.results_q.get())
-        return self.result
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                return not self.isCancelled()
+            if isInterrupted():
+                self.cancel()
+            wait(futures, timeout=interval, return_when=FIRST_COMPLETED)
+
+    def shutdown(self, wait=True):
+        self.closed.set()
+        if not wait:
+            self.cancel()
+        self.pool.shutdown(wait=wait)
+
+    def logStats(self):
+        stats = self.stats
+        average = stats['elapsed'] / max(1, stats['completed'] + stats['failed'])
+        logger.info(f"{self.name}: 提交{stats['submitted']}个任务，完成{stats['completed']}个，失败{stats['failed']}个，"
+                    f"取消{stats['cancelled']}个，平均耗时{average:.2f}秒，最长{stats['slowest']:.2f}秒")
+        for error, count in self.errors.most_common():
+            logger.warning(f'{self.name}: {error} {count}次')
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.wait_complete()
+        # 取消后不等待正在执行的任务，它们会在下一次检查取消事件时退出
+        self.shutdown(wait=exc_type is None and not self.isCancelled())
+        self.logStats()
@@ -0,0 +1,132 @@
+import re
+import json
+import time
+import logging
+from threading import Lock
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# 按URL判断接口，顺序有关：更具体的规则放前面
+ENDPOINTS = (
+    (re.compile(r'/wordscollection/words/[^/?]+'), 'word'),
+    (re.compile(r'/wordscollection/words'), 'words'),
+    (re.compile(r'/abc/words/vocabularies/[^/]+/examples'), 'examples'),
+    (re.compile(r'/reading/bilingual'), 'translate'),
+    (re.compile(r'/reading/articles/'), 'article'),
+    (re.compile(r'/reading/books/[^/]+/static_catalogs'), 'catalogs'),
+    (re.compile(r'/bayuser/'), 'user'),
+)
+# 延迟直方图的上界(毫秒)，最后一档是更慢的请求
+BUCKETS = (50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def endpointOf(url):
+    for pattern, name in ENDPOINTS:
+        if pattern.search(url):
+            return name
+    return 'other'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        self.statuses = Counter()
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+
+    def percentile(self, p):
+        # 按直方图估算，返回所在档位的上界(毫秒)，不超过实际的最长耗时
+        target = self.requests * p
+        seen = 0
+        longest = round(self.maxTime * 1000)
+        for bound, count in zip(BUCKETS + (None,), self.histogram):
+            seen += count
+            if count and seen >= target:
+                return min(bound, longest) if bound is not None else longest
+        return 0
+
+    def toDict(self):
+        return dict(requests=self.requests, retries=self.retries, errors=self.errors, bytes=self.bytes,
+                    statuses={str(k): v for k, v in sorted(self.statuses.items())},
+                    averageMs=round(self.totalTime * 1000 / self.requests, 1) if self.requests else 0,
+                    p50Ms=self.percentile(0.5), p95Ms=self.percentile(0.95), maxMs=round(self.maxTime * 1000),
+                    histogram={f'<{b}ms' if b else 'slower': c for b, c in zip(BUCKETS + (None,), self.histogram)})
+
+
+class NetworkStats:
+    # 记录每个接口的请求数、重试次数、状态码、流量和延迟分布，通过requests的response钩子采集
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.started = time.time()
+
+    def get(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    def hook(self, endpoint=None):
+        def onResponse(r, *args, **kwargs):
+            self.record(endpoint or endpointOf(r.url), r, kwargs.get('stream', False))
+        return onResponse
+
+    def install(self, session, endpoint=None):
+        session.hooks['response'].append(self.hook(endpoint))
+
+    def record(self, endpoint, r, stream=False):
+        elapsed = r.elapsed.total_seconds()
+        retries = getattr(getattr(r.raw, 'retries', None), 'history', None) or ()
+        # 非流式的响应在这里读完(requests随后也会读，不会重复下载)，流式的只能按Content-Length计算
+        if stream:
+            size = int(r.headers.get('Content-Length') or 0)
+        else:
+            size = len(r.content)
+        with self.lock:
+            stats = self.get(endpoint)
+            stats.requests += 1
+            stats.retries += len(retries)
+            stats.bytes += size
+            stats.statuses[r.status_code] += 1
+            stats.totalTime += elapsed
+            stats.maxTime = max(stats.maxTime, elapsed)
+            stats.histogram[sum(elapsed * 1000 >= b for b in BUCKETS)] += 1
+
+    def recordRetry(self, url):
+        # ShanbayAPI.request()在429/5xx之后自己发起的重试
+        with self.lock:
+            self.get(endpointOf(url)).retries += 1
+
+    def recordError(self, url, endpoint=None):
+        with self.lock:
+            self.get(endpoint or endpointOf(url)).errors += 1
+
+    def toDict(self):
+        with self.lock:
+            return dict(started=self.started, duration=round(time.time() - self.started, 1),
+                        endpoints={name: stats.toDict() for name, stats in sorted(self.endpoints.items())})
+
+    def format(self):
+        data = self.toDict()
+        lines = [f"{'接口':<10}{'请求':>7}{'重试':>6}{'错误':>6}{'流量KB':>9}{'平均ms':>8}{'p50':>7}{'p95':>7}{'最长':>7}  状态码"]
+        for name, stats in data['endpoints'].items():
+            statuses = ' '.join(f'{k}:{v}' for k, v in stats['statuses'].items())
+            lines.append(f"{name:<10}{stats['requests']:>7}{stats['retries']:>6}{stats['errors']:>6}{stats['bytes'] / 1024:>9.0f}"
+                         f"{stats['averageMs']:>8}{stats['p50Ms']:>7}{stats['p95Ms']:>7}{stats['maxMs']:>7}  {statuses}")
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.toDict(), f, ensure_ascii=False, indent=2)
+        logger.info(f'网络统计已保存到{path}\n{self.format()}')
+
+
+stats = NetworkStats()
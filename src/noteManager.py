@@ -1,7 +1,11 @@
 from aqt import mw
 import anki
+import json
 import logging
 import os
+import hashlib
+import time
+from itertools import islice
 
 from .constants import MODEL_FIELDS
 
@@ -15,8 +19,6 @@ def getOrCreateDeck(deckName):
     deck_id = mw.col.decks.id(deckName)
     deck = mw.col.decks.get(deck_id)
     mw.col.decks.save(deck)
-    mw.col.reset()
-    mw.reset()
     return deck
 
 
@@ -54,13 +56,67 @@ def getOrCreateModelCardTemplate(modelObject, cardTemplateName):
     mw.col.models.add(modelObject)
 
 
-def addWordToDeck(deckObject, modelObject, word):
-    modelObject['did'] = deckObject['id']
-
+def newWordNote(modelObject, word):
     newNote = anki.notes.Note(mw.col, modelObject)
     for (k, v) in word.items():
         if k in MODEL_FIELDS and v is not None:
             newNote[k] = v
-    mw.col.addNote(newNote)
+    return newNote
+
+
+def fingerprintOf(word):
+    fields = {k: v for k, v in word.items() if k in MODEL_FIELDS and v is not None}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def addWordsToDeck(deckObject, modelObject, words, getKnownNotes, saveKnownNotes, batchSize=100,
+                   isInterrupted=lambda: False, onBatch=lambda count: None):
+    # words为(扇贝单词id, 字段)序列，已在牌组中且字段没有变化的单词直接跳过，字段变化的更新原笔记
+    # 可以在后台线程中调用：每批提交一次集合，批与批之间可以取消，已提交的单词下次创建时会被跳过
+    modelObject['did'] = deckObject['id']
+
+    words = iter(words)
+    stats = dict(added=0, updated=0, skipped=0)
+    start = time.perf_counter()
+    while not isInterrupted():
+        batch = list(islice(words, batchSize))
+        if not batch:
+            break
+        knownNotes = getKnownNotes([wordId for wordId, _ in batch])
+        existingNotes = set(mw.col.db.list('SELECT id FROM notes WHERE id IN ({})'.format(
+            ','.join(str(int(noteId)) for noteId, _ in knownNotes.values()))))
+        changedNotes = []
+        for wordId, word in batch:
+            fingerprint = fingerprintOf(word)
+            noteId, knownFingerprint = knownNotes.get(wordId, (None, None))
+            if noteId in existingNotes:
+                if knownFingerprint == fingerprint:
+                    stats['skipped'] += 1
+                    continue
+                note = mw.col.getNote(noteId)
+                for field in MODEL_FIELDS:
+                    note[field] = word.get(field) or ''
+                note.flush()
+                stats['updated'] += 1
+            else:
+                note = newWordNote(modelObject, word)
+                mw.col.addNote(note)
+                stats['added'] += 1
+            changedNotes.append((wordId, note.id, fingerprint))
+        if changedNotes:
+            mw.col.save()
+        saveKnownNotes(changedNotes)
+        onBatch(len(batch))
+        logger.info(f"已处理{sum(stats.values())}个单词")
+
+    elapsed = time.perf_counter() - start
+    count = sum(stats.values())
+    logger.info(f"新增{stats['added']}个笔记，更新{stats['updated']}个，跳过{stats['skipped']}个，"
+                f"用时{elapsed:.2f}秒，{count / elapsed if elapsed else 0:.1f}个/秒")
+    return stats
+
+
+def refreshCollection():
+    # 只能在主线程中调用
     mw.col.reset()
-    logger.info(f"添加笔记{newNote['word']}")
+    mw.reset()
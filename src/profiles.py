@@ -0,0 +1,73 @@
+import os
+import re
+import hashlib
+
+# 每个扇贝账户一个配置档：自己的cookie、牌组名和数据库，默认配置档沿用原来的文件名和顶层cookie
+DEFAULT_PROFILE = ''
+PROFILE_NAME = re.compile(r'^[\w-]+$')
+# Anki升级插件时保留user_files目录，放在这里的文件不会混进媒体文件夹
+USER_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_files')
+
+
+def checkProfile(profile):
+    if profile != DEFAULT_PROFILE and not PROFILE_NAME.match(profile):
+        raise ValueError(f'配置档名称只能包含字母、数字、下划线和减号: {profile}')
+    return profile
+
+
+def fileName(base, profile, extension):
+    return f'{base}.{extension}' if profile == DEFAULT_PROFILE else f'{base}_{checkProfile(profile)}.{extension}'
+
+
+def databaseName(profile=DEFAULT_PROFILE):
+    return fileName('shanbay2anki', profile, 'db')
+
+
+def cacheName(profile=DEFAULT_PROFILE):
+    # 单词列表等接口的内容因账户而异，缓存不能共用
+    return fileName('shanbay2anki_cache', profile, 'db')
+
+
+def userFileName(name, profile=DEFAULT_PROFILE):
+    # user_files由所有Anki用户共用，每个Anki用户的媒体文件夹里各有一个数据库，文件名带上所服务的数据库路径的哈希
+    base, extension = os.path.splitext(name)
+    key = hashlib.sha1(os.path.abspath(databaseName(profile)).encode('utf-8')).hexdigest()[:12]
+    return f'{base}_{key}{extension}'
+
+
+def cachePath(profile=DEFAULT_PROFILE, directory=USER_FILES):
+    # 缓存按数据库区分，不同账户不会用到彼此的ETag
+    path = os.path.join(directory, userFileName(cacheName(profile), profile))
+    if not os.path.exists(path):
+        # 第一次使用新位置时删掉旧版本放在媒体文件夹里的缓存，缓存只是可以丢弃的副本
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cacheName(profile) + suffix):
+                os.remove(cacheName(profile) + suffix)
+        os.makedirs(directory, exist_ok=True)
+    return path
+
+
+def statsName(profile=DEFAULT_PROFILE):
+    return fileName('shanbay2anki_stats', profile, 'json')
+
+
+def statsPath(profile=DEFAULT_PROFILE, directory=USER_FILES):
+    # 网络统计同样不放进媒体文件夹
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, userFileName(statsName(profile), profile))
+
+
+def profileNames(config):
+    return list(config.get('profiles', {}))
+
+
+def profileConfig(config, profile=DEFAULT_PROFILE):
+    # 配置档中的项(cookie、deck等)覆盖顶层配置
+    if profile == DEFAULT_PROFILE:
+        return dict(config)
+    profiles = config.get('profiles', {})
+    if checkProfile(profile) not in profiles:
+        raise KeyError(f'没有找到配置档: {profile}')
+    merged = dict(config)
+    merged.update(profiles[profile])
+    return merged
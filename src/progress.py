@@ -0,0 +1,57 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+class ProgressReporter:
+    # 在工作线程中累计进度，最多每interval秒调用一次emit(已完成, 总数, 每秒完成数, 预计剩余秒数)
+    # 速度按最近window秒计算，ETA未知时为-1
+    def __init__(self, emit, total=0, interval=0.1, window=10.0):
+        self.emit = emit
+        self.total = total
+        self.interval = interval
+        self.window = window
+        self.done = 0
+        self.lock = Lock()
+        self.samples = deque([(time.monotonic(), 0)])
+        self.lastEmit = 0.0
+
+    def setTotal(self, total):
+        with self.lock:
+            self.total = total
+        self.report()
+
+    def advance(self, n=1):
+        with self.lock:
+            self.done += n
+        self.report()
+
+    def rate(self, now):
+        while len(self.samples) > 1 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        start, done = self.samples[0]
+        return (self.done - done) / (now - start) if now > start else 0.0
+
+    def report(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.lastEmit < self.interval:
+                return
+            self.lastEmit = now
+            self.samples.append((now, self.done))
+            rate = self.rate(now)
+            eta = (self.total - self.done) / rate if rate > 0 and self.total >= self.done else -1
+            self.emit(self.done, self.total, rate, eta)
+
+    def finish(self):
+        self.report(force=True)
+
+
+def formatProgress(done, total, rate, eta):
+    text = f'{done}/{total}'
+    if rate > 0:
+        text += f'  {rate:.1f}个/秒'
+    if eta >= 0:
+        minutes, seconds = divmod(int(eta), 60)
+        text += f'  剩余{minutes}分{seconds:02d}秒' if minutes else f'  剩余{seconds}秒'
+    return text
@@ -0,0 +1,108 @@
+import time
+import logging
+from threading import Condition
+from concurrent.futures import CancelledError
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def parseRetryAfter(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    # 令牌桶限制请求速率，同时限制并发请求数
+    # 开始时每个成功请求都把实际卡住请求的速率或并发翻倍(慢启动)，第一次受限后改为每轮(limit个成功请求)加一；
+    # 遇到429/5xx或连接异常时减半(AIMD)。不设速率上限，最终停在服务器能接受的最高速率附近
+    def __init__(self, rate=4.0, minRate=0.5, maxRate=float('inf'), limit=2, maxLimit=16):
+        self.initialRate = rate
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.initialLimit = limit
+        self.maxLimit = maxLimit
+        self.active = 0
+        self.cond = Condition()
+        self.reset()
+
+    def reset(self, limit=None):
+        # 每次同步开始时恢复初始速率并重新慢启动，并发从线程池的并发数开始
+        with self.cond:
+            self.rate = self.initialRate
+            self.limit = min(self.maxLimit, limit or self.initialLimit)
+            self.slowStart = True
+            self.waitedForTokens = False
+            self.waitedForSlot = False
+            self.tokens = 1.0
+            self.successes = 0
+            self.lastRefill = time.monotonic()
+            self.lastDecrease = 0.0
+            self.blockedUntil = 0.0
+            self.cond.notify_all()
+
+    def refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+
+    def acquire(self, cancelled=None):
+        # cancelled被触发时抛出CancelledError，最多0.1秒就能发现
+        with self.cond:
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    raise CancelledError()
+                now = time.monotonic()
+                self.refill(now)
+                if now >= self.blockedUntil and self.active < self.limit and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+                if now < self.blockedUntil:
+                    timeout = self.blockedUntil - now
+                elif self.active >= self.limit:
+                    self.waitedForSlot = True
+                    timeout = None
+                else:
+                    self.waitedForTokens = True
+                    timeout = (1 - self.tokens) / self.rate
+                if cancelled is not None:
+                    timeout = 0.1 if timeout is None else min(timeout, 0.1)
+                self.cond.wait(timeout)
+
+    def increase(self, value):
+        return value * 2 if self.slowStart else value + 1
+
+    def release(self, status=None, retryAfter=None):
+        with self.cond:
+            self.active -= 1
+            now = time.monotonic()
+            if status is None or status == 429 or status >= 500:
+                if retryAfter:
+                    self.blockedUntil = max(self.blockedUntil, now + retryAfter)
+                # 同一时刻的多个失败请求只减速一次
+                if now - self.lastDecrease > 1 / self.rate:
+                    self.rate = max(self.minRate, self.rate / 2)
+                    self.limit = max(1, self.limit // 2)
+                    self.lastDecrease = now
+                    logger.info(f'请求受限({status})，降低到每秒{self.rate:.1f}个请求，并发{self.limit}')
+                self.slowStart = False
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.slowStart or self.successes >= self.limit:
+                    # 只提高这一轮中真正限制了请求的那一项，速率不会在用不到时无限增长
+                    self.successes = 0
+                    if self.waitedForTokens:
+                        self.rate = min(self.maxRate, self.increase(self.rate))
+                    if self.waitedForSlot:
+                        self.limit = min(self.maxLimit, self.increase(self.limit))
+                    self.waitedForTokens = self.waitedForSlot = False
+            self.cond.notify_all()
@@ -0,0 +1,94 @@
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, content, headers):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    # 按URL缓存接口返回的内容，过期后用ETag/Last-Modified向服务器确认是否有变化
+    # 总大小超过上限时按最近访问时间淘汰
+    def __init__(self, path, maxSize=64 * 1024 * 1024):
+        self.maxSize = maxSize
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                             url TEXT PRIMARY KEY, endpoint TEXT, content BLOB, etag TEXT, last_modified TEXT,
+                             fetched_at REAL, accessed_at REAL, size INTEGER)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+        self.stats = dict(hits=0, revalidated=0, misses=0, stored=0, evicted=0)
+
+    def lookup(self, url):
+        with self.lock:
+            return self.conn.execute('SELECT content, etag, last_modified, fetched_at FROM responses WHERE url = ?', (url,)).fetchone()
+
+    def isFresh(self, entry, ttl):
+        return entry is not None and time.time() - entry[3] < ttl
+
+    def validators(self, entry):
+        headers = {}
+        if entry is not None and entry[1]:
+            headers['If-None-Match'] = entry[1]
+        if entry is not None and entry[2]:
+            headers['If-Modified-Since'] = entry[2]
+        return headers
+
+    def hit(self, url, entry, revalidated=False):
+        now = time.time()
+        with self.lock:
+            self.stats['revalidated' if revalidated else 'hits'] += 1
+            if revalidated:
+                self.conn.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+            else:
+                self.conn.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+            self.conn.commit()
+        return CachedResponse(url, 200, entry[0], {})
+
+    def store(self, url, endpoint, response):
+        now = time.time()
+        content = response.content
+        with self.lock:
+            self.stats['misses'] += 1
+            if len(content) > self.maxSize // 10:
+                return
+            old = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (url, endpoint, content, response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(content)))
+            self.size += len(content) - (old[0] if old else 0)
+            self.stats['stored'] += 1
+            if self.size > self.maxSize:
+                self.evict()
+            self.conn.commit()
+
+    def miss(self):
+        with self.lock:
+            self.stats['misses'] += 1
+
+    def evict(self):
+        target = self.maxSize * 0.9
+        for url, size in self.conn.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall():
+            if self.size <= target:
+                break
+            self.conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self.size -= size
+            self.stats['evicted'] += 1
+
+    def logStats(self):
+        logger.info('缓存命中{hits}次，确认未变化{revalidated}次，下载{misses}次，淘汰{evicted}条'.format(**self.stats))
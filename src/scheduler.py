@@ -0,0 +1,203 @@
+import logging
+from collections import deque
+from concurrent.futures import wait, CancelledError, FIRST_COMPLETED
+from .misc import Executor
+
+logger = logging.getLogger(__name__)
+
+
+class SyncScheduler:
+    # 单词详情、例句、翻译三类任务共用一个线程池，某个单词的详情写入后立即开始下载它的例句和翻译
+    # 所有写库操作都在调用run()的线程中进行，单词详情按单词顺序写入
+    def __init__(self, api, concurrency=1, incremental=False, batchSize=100, example=True, translate=True):
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self.incremental = incremental
+        self.batchSize = batchSize
+        self.example = example
+        self.translate = translate
+        self.isInterrupted = lambda: False
+        self.onTick = lambda: None
+        self.onTotal = lambda total: None
+
+    def run(self, total=0):
+        self.words = []
+        self.examples = []
+        self.translates = []
+        self.syncPage = None
+        self.spawned = deque()
+        self.scheduledTranslates = set()
+        self.running = 0
+        self.ordered = deque()
+        self.others = {}
+        self.failed = dict(example=0, translate=0)
+        self.api.limiter.reset(self.concurrency)
+
+        initial = deque()
+        if self.example:
+            initial.extend(('example', row['id']) for row in self.api.getWordsWithoutExample())
+        if self.translate:
+            for row in self.api.getSentencesWithoutTranslate():
+                self.scheduledTranslates.add(row['sentence'])
+                initial.append(('translate', row))
+        self.wordTotal = total
+        self.total = total + len(initial)
+        self.onTotal(self.total)
+
+        try:
+            with Executor(self.concurrency, name='sync') as executor:
+                executor.cancelWhen(self.isInterrupted)
+                try:
+                    finished = self.loop(executor, initial)
+                except CancelledError:
+                    # 中断时正在等待的任务被取消
+                    if not self.isInterrupted():
+                        raise
+                    finished = False
+                finally:
+                    executor.cancel()
+        finally:
+            self.flushTranslates()
+            self.flushExamples()
+            self.flushWords()
+
+        if any(self.failed.values()):
+            logger.warning(f"例句下载失败{self.failed['example']}个，翻译下载失败{self.failed['translate']}个，下次同步时重试")
+        if finished:
+            self.api.finishSync()
+        return finished
+
+    def wordJobs(self, executor):
+        for page, wordList, updatedAt, bookCodes in self.api.getWordsToSync(self.incremental, self.wordTotal or None, executor):
+            self.api.prefetchCatalogs(bookCodes, executor)
+            for word, needDownload in wordList:
+                if needDownload:
+                    yield 'word', word
+                else:
+                    logger.info(f"Skip word {word}")
+                    yield 'skip', word
+            yield 'page', (page, updatedAt)
+
+    def submit(self, executor, kind, value):
+        self.running += 1
+        if kind == 'word':
+            return executor.submit(self.api.fetchWord, value)
+        if kind == 'example':
+            return executor.submit(self.api.fetchWordExamples, value)
+        return executor.submit(self.api.fetchSentenceTranslate, value)
+
+    def loop(self, executor, initial):
+        # ordered中的单词详情按顺序处理，others中的例句和翻译任务完成即处理
+        wordJobs = self.wordJobs(executor)
+        window = self.concurrency * 2
+        exhausted = False
+        preferInitial = False
+
+        while True:
+            if self.isInterrupted():
+                return False
+
+            while self.running < window:
+                preferInitial = not preferInitial
+                if self.spawned:
+                    kind, value = self.spawned.popleft()
+                    self.others[self.submit(executor, kind, value)] = kind
+                elif initial and (preferInitial or exhausted or len(self.ordered) >= window):
+                    kind, value = initial.popleft()
+                    self.others[self.submit(executor, kind, value)] = kind
+                elif not exhausted and len(self.ordered) < window:
+                    job = next(wordJobs, None)
+                    if job is None:
+                        exhausted = True
+                        continue
+                    kind, value = job
+                    self.ordered.append((kind, self.submit(executor, kind, value) if kind == 'word' else value))
+                else:
+                    break
+
+            progressed = False
+            while self.ordered and (self.ordered[0][0] != 'word' or self.ordered[0][1].done()):
+                kind, value = self.ordered.popleft()
+                self.process(kind, value)
+                progressed = True
+            for future in [f for f in self.others if f.done()]:
+                self.process(self.others.pop(future), future)
+                progressed = True
+
+            if progressed:
+                continue
+            if exhausted and not initial and not self.spawned and not self.ordered and not self.others:
+                return True
+            futures = [value for kind, value in self.ordered if kind == 'word'] + list(self.others)
+            if futures:
+                wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+
+    def spawn(self, kind, value):
+        self.spawned.append((kind, value))
+        self.total += 1
+
+    def process(self, kind, value):
+        if kind == 'page':
+            self.syncPage = value
+            return
+        if kind == 'word':
+            self.running -= 1
+            row = value.result()
+            total = self.total
+            if self.example and self.api.needsExamples(row['id']):
+                self.spawn('example', row['id'])
+            if self.translate:
+                for source in self.api.getSourcesToTranslate(row):
+                    if source['sentence'] not in self.scheduledTranslates:
+                        self.scheduledTranslates.add(source['sentence'])
+                        self.spawn('translate', source)
+            if self.total != total:
+                self.onTotal(self.total)
+            self.words.append(row)
+            if len(self.words) >= self.batchSize:
+                self.flushWords()
+        elif kind == 'example':
+            self.running -= 1
+            result = self.optionalResult(kind, value)
+            if result is not None:
+                self.examples.append(result)
+                if len(self.examples) >= self.batchSize:
+                    self.flushExamples()
+        elif kind == 'translate':
+            self.running -= 1
+            result = self.optionalResult(kind, value)
+            if result is not None:
+                self.translates.append(result)
+                if len(self.translates) >= self.batchSize:
+                    self.flushTranslates()
+        self.onTick()
+
+    def optionalResult(self, kind, future):
+        # 例句和翻译下载失败不影响同步单词，没有写入的下次同步时会重新下载
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            self.failed[kind] += 1
+            logger.warning(f'{kind}任务失败: {type(e).__name__}: {e}')
+            return None
+
+    def flushWords(self):
+        if self.words or self.syncPage is not None:
+            self.api.saveWords(self.words, self.syncPage)
+        self.words = []
+        self.syncPage = None
+
+    def flushExamples(self):
+        # 例句和翻译依赖单词和来源已经写入
+        if self.examples:
+            self.flushWords()
+            self.api.saveWordExamples(self.examples)
+        self.examples = []
+
+    def flushTranslates(self):
+        if self.translates:
+            self.flushWords()
+            self.api.saveSentenceTranslates(self.translates)
+        self.translates = []
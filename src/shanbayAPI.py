@@ -1,41 +1,80 @@
 import os
+import time
 import sqlite3
 import logging
 import requests
+from collections import deque
+from concurrent.futures import CancelledError
 from requests.compat import urljoin
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
-from .constants import MODEL_FIELDS, DB_FIELDS, WEB_LINK, APP_LINK
-from .noteManager import getOrCreateDeck, getOrCreateModel, getOrCreateModelCardTemplate, addWordToDeck
+from .constants import MODEL_FIELDS, DB_FIELDS, SOURCE_FIELDS, CARD_SOURCES, CARD_EXAMPLES, NEWS_BOOK_NAME, WEB_LINK, APP_LINK
+from .database import setupDatabase
+from .rateLimiter import AdaptiveRateLimiter, parseRetryAfter
+from .responseCache import ResponseCache
+from .catalogStore import CatalogStore
+from .singleFlight import SingleFlight
+from .netStats import stats as netStats
+from .archive import pack
+from .misc import currentCancelEvent
+from .profiles import DEFAULT_PROFILE, USER_FILES, databaseName, cachePath
 
 logger = logging.getLogger(__name__)
+sqlLogger = logging.getLogger(__package__ + '.sql')
 
 API_URL = 'https://apiv3.shanbay.com/'
+DAY = 24 * 60 * 60
+PAGE_SIZE = 50
 
 class ShanbayAPI():
+    apiUrl = API_URL
     loginUrl = 'https://web.shanbay.com/web/account/login/'
     timeout = 10
     headers = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36',
     }
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session = requests.Session()
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-
-    def __init__(self):
-        self.conn = sqlite3.connect('shanbay2anki.db', check_same_thread=False)
-        self.conn.set_trace_callback(logger.debug)
+    # 连接错误和429/5xx都只由request()配合限流器重试
+    maxAttempts = 5
+    # 各接口缓存的有效期(秒)，0表示每次都向服务器确认是否有变化
+    cacheTTL = {
+        'words': 0,
+        'word': 0,
+        'examples': 30 * DAY,
+        'translate': 30 * DAY,
+        'article': 30 * DAY,
+        'catalogs': 7 * DAY,
+    }
+
+    def __init__(self, cacheSize=64, profile=DEFAULT_PROFILE, cacheDir=USER_FILES):
+        # 每个配置档(账户)使用自己的数据库、缓存和会话
+        self.profile = profile
+        self.session = self.newSession()
+        self.limiter = AdaptiveRateLimiter()
+        self.conn = sqlite3.connect(databaseName(profile), check_same_thread=False)
+        if sqlLogger.isEnabledFor(logging.DEBUG):
+            self.conn.set_trace_callback(sqlLogger.debug)
         self.conn.row_factory = sqlite3.Row
         self.db = self.conn.cursor()
-        #self.db.execute('DROP TABLE IF EXISTS words')
-        self.db.execute('CREATE TABLE IF NOT EXISTS words ({})'.format(','.join(map(lambda c:c+' TEXT', DB_FIELDS))))
-        self.chapterNames = {}
-        self.bookNames = {}
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('PRAGMA temp_store = MEMORY')
+        self.db.execute('PRAGMA cache_size = -16000')
+        setupDatabase(self.conn)
+        self.cache = ResponseCache(cachePath(profile, cacheDir), cacheSize * 1024 * 1024)
+        self.catalogs = CatalogStore(databaseName(profile))
+        self.missingCatalogs = set()
+        self.inFlight = SingleFlight()
+        self.bookIds = {}
+        # 从存档重新生成单词时置为True，只使用缓存和数据库，不发出请求
+        self.offline = False
+
+    @staticmethod
+    def newSession():
+        session = requests.Session()
+        netStats.install(session)
+        return session
 
     def checkCookie(self, cookie):
-        rsp = requests.get(urljoin(API_URL, 'bayuser/user_detail'), cookies=cookie, headers=self.headers)
+        rsp = requests.get(urljoin(self.apiUrl, 'bayuser/user_detail'), cookies=cookie, headers=self.headers)
         if rsp.status_code == 200:
             logger.info('Cookie有效')
             cookiesJar = requests.utils.cookiejar_from_dict(cookie, cookiejar=None, overwrite=True)
@@ -50,187 +89,476 @@ class ShanbayAPI():
             return True
         return False
 
+    def get(self, url, endpoint=None):
+        if endpoint not in self.cacheTTL:
+            return self.request(url)
+        entry = self.cache.lookup(url)
+        if self.cache.isFresh(entry, self.cacheTTL[endpoint]) or self.offline and entry is not None:
+            return self.cache.hit(url, entry)
+        r = self.request(url, self.cache.validators(entry))
+        if r.status_code == 304 and entry is not None:
+            return self.cache.hit(url, entry, revalidated=True)
+        if r.status_code == 200:
+            self.cache.store(url, endpoint, r)
+        else:
+            self.cache.miss()
+        return r
+
+    def request(self, url, headers=None, cancelled=None):
+        # 在线程池中执行时，取消后不再排队等待限流或重试，抛出CancelledError
+        cancelled = cancelled or currentCancelEvent()
+        if self.offline:
+            raise requests.ConnectionError(f'离线模式，不请求{url}')
+        for attempt in range(1, self.maxAttempts + 1):
+            self.limiter.acquire(cancelled)
+            try:
+                r = self.session.get(url, timeout=self.timeout, headers=headers)
+            except requests.RequestException:
+                self.limiter.release()
+                netStats.recordError(url)
+                if attempt == self.maxAttempts:
+                    raise
+                logger.warning(f'请求{url}异常，第{attempt}次重试')
+                retryAfter = None
+            else:
+                retryAfter = parseRetryAfter(r.headers.get('Retry-After'))
+                self.limiter.release(r.status_code, retryAfter)
+                if r.status_code != 429 and r.status_code < 500:
+                    return r
+                if attempt == self.maxAttempts:
+                    r.raise_for_status()
+                logger.warning(f'请求{url}返回{r.status_code}，第{attempt}次重试')
+                netStats.recordRetry(url)
+            if retryAfter is None and cancelled.wait(min(2 ** attempt, 30)):
+                raise CancelledError()
+
     def getWord(self, word):
-        url = urljoin(API_URL, 'wordscollection/words/' + word)
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, 'wordscollection/words/' + word)
+        r = self.get(url, 'word')
         return r.json()
 
     def getWordNumber(self):
-        url = urljoin(API_URL, 'wordscollection/words')
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, 'wordscollection/words')
+        r = self.get(url, 'words')
         return r.json()['total']
 
     def getWordsByPage(self, idx):
-        url = urljoin(API_URL, f'wordscollection/words?ipp=50&page={idx}')
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, f'wordscollection/words?ipp={PAGE_SIZE}&page={idx}')
+        r = self.get(url, 'words')
         return r.json()
 
     def getWordExamples(self, word):
-        url = urljoin(API_URL, f'abc/words/vocabularies/{word}/examples')
-        r = self.session.get(url, timeout=self.timeout)
-        for example in r.json():
-            yield (example['content_en'].replace('vocab>', 'b>'), example['content_cn'], word)
-        yield ("", "", word)
-        yield ("", "", word)
+        url = urljoin(self.apiUrl, f'abc/words/vocabularies/{word}/examples')
+        r = self.get(url, 'examples')
+        return r.json()
+
+    @staticmethod
+    def parseExamples(word, examples):
+        return [(word, idx, example['content_en'].replace('vocab>', 'b>'), example['content_cn']) for idx, example in enumerate(examples, 1)]
 
     def getSentenceTranslate(self, sentence):
+        return self.inFlight.do(('translate', sentence), self.downloadSentenceTranslate, sentence)
+
+    def downloadSentenceTranslate(self, sentence):
         from .bays import convert
-        url = urljoin(API_URL, f'reading/bilingual?sentence_id={sentence}')
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, f'reading/bilingual?sentence_id={sentence}')
+        r = self.get(url, 'translate')
         return convert(r.json()['text'])
 
     def getArticle(self, chapter):
-        url = urljoin(API_URL, f'reading/articles/{chapter}')
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, f'reading/articles/{chapter}')
+        r = self.get(url, 'article')
         return r.json()
 
     def getBookCatalogs(self, book):
-        url = urljoin(API_URL, f'reading/books/{book}/static_catalogs')
-        r = self.session.get(url, timeout=self.timeout)
+        url = urljoin(self.apiUrl, f'reading/books/{book}/static_catalogs')
+        r = self.get(url, 'catalogs')
         if r.status_code == 200:
             return r.json()
         return None
 
+    def loadCatalogs(self, book):
+        if self.catalogs.getBook(book) is not None:
+            return True
+        if book in self.missingCatalogs:
+            return False
+        return self.inFlight.do(('catalogs', book), self.downloadCatalogs, book)
+
+    def downloadCatalogs(self, book):
+        if self.catalogs.getBook(book) is not None:
+            return True
+        catalogs = self.getBookCatalogs(book)
+        if catalogs is None:
+            self.missingCatalogs.add(book)
+            return False
+        self.catalogs.saveCatalogs(book, catalogs)
+        return True
+
+    def prefetchCatalogs(self, books, executor):
+        for book in set(books):
+            if self.catalogs.getBook(book) is None and book not in self.missingCatalogs:
+                executor.submit(self.loadCatalogs, book)
+
     def getChapterName(self, book, chapter):
-        if chapter not in self.chapterNames:
-            catalogs = self.getBookCatalogs(book)
-            if catalogs is not None:
-                self.bookNames[book] = {'cn': catalogs['book']['name_cn'], 'en': catalogs['book']['name_en']}
-                for c in catalogs['catalogs']:
-                    self.chapterNames[c['id']] = {'cn': c['title_cn'], 'en': c['title_en'], 'id': c['id']}
-            else:
-                article = self.getArticle(chapter)
-                self.chapterNames[chapter] =  {'cn': article['title_cn'], 'en': article['title_en'], 'id': article['id']}
-                if book not in self.bookNames:
-                    catalogs = self.getBookCatalogs(article['book_id'])
-                    self.bookNames[book] =  {'cn': catalogs['book']['name_cn'], 'en': catalogs['book']['name_en']}
-        bookNameCN = self.bookNames[book]['cn']
-        bookNameEN = self.bookNames[book]['en']
-        chapterID = self.chapterNames[chapter]['id']
-        chapterNameCN = self.chapterNames[chapter]['cn']
-        chapterNameEN = self.chapterNames[chapter]['en']
-        return bookNameCN, bookNameEN, chapterID, chapterNameCN, chapterNameEN
-
-    def insertWord(self, word):
-        self.db.execute('SELECT 1 FROM words WHERE id=? LIMIT 1', (word,))
-        if self.db.fetchone() is not None:
-            logger.info(f"Skip word {word}")
+        if self.catalogs.getChapter(chapter) is None or self.catalogs.getBook(book) is None:
+            self.loadCatalogs(book)
+        if self.catalogs.getChapter(chapter) is None or self.catalogs.getBook(book) is None:
+            self.inFlight.do(('article', chapter), self.downloadArticleCatalog, book, chapter)
+        bookInfo = self.catalogs.getBook(book)
+        chapterInfo = self.catalogs.getChapter(chapter)
+        return bookInfo['cn'], bookInfo['en'], chapterInfo['id'], chapterInfo['cn'], chapterInfo['en']
+
+    def downloadArticleCatalog(self, book, chapter):
+        if self.catalogs.getChapter(chapter) is not None and self.catalogs.getBook(book) is not None:
             return
+        article = self.getArticle(chapter)
+        if self.catalogs.getBook(book) is None and self.loadCatalogs(article['book_id']):
+            bookInfo = self.catalogs.getBook(article['book_id'])
+            self.catalogs.saveBook(book, bookInfo['cn'], bookInfo['en'])
+        self.catalogs.saveChapter(chapter, article['id'], article['title_cn'], article['title_en'], book)
+
+    def hasWord(self, word):
+        self.db.execute('SELECT 1 FROM words WHERE id=? LIMIT 1', (word,))
+        return self.db.fetchone() is not None
+
+    def fetchWord(self, word):
         wordData = self.getWord(word)
+        row = self.parseWord(word, wordData)
+        row['payload'] = pack(wordData)
+        return row
+
+    def parseWord(self, word, wordData):
         vocab = wordData['vocabulary']
         definition_cn = ''
+        definition_en = ''
         for sense in vocab['senses']:
             definition_cn += sense['pos'] + ' ' + sense['definition_cn'] + '<br>'
+            if sense.get('definition_en'):
+                definition_en += sense['pos'] + ' ' + sense['definition_en'] + '<br>'
         ipa_uk = vocab['sound']['ipa_uk']
         ipa_uk = "/{}/".format(ipa_uk) if ipa_uk else None
         ipa_us = vocab['sound']['ipa_us']
         ipa_us = "/{}/".format(ipa_us) if ipa_us else None
         ipa_uk_url = (vocab['sound']['audio_uk_urls'] + [None])[0]
         ipa_us_url = (vocab['sound']['audio_us_urls'] + [None])[0]
-        values = (word, vocab['word'], ipa_uk, ipa_uk_url, ipa_us, ipa_us_url, definition_cn)
-        self.db.execute("INSERT INTO words (id, word, ipa_uk, ipa_uk_url, ipa_us, ipa_us_url, definition_cn) VALUES (?, ?, ?, ?, ?, ?, ?)", values)
+        row = dict(id=word, word=vocab['word'], ipa_uk=ipa_uk, ipa_uk_url=ipa_uk_url, ipa_us=ipa_us, ipa_us_url=ipa_us_url, definition_cn=definition_cn,
+                   definition_en=definition_en or None)
 
-        self.db.execute("UPDATE words set updated_at = ? where id = ?", (wordData['objects'][0]['updated_at'], word))
-        idx = 1
+        row['updated_at'] = wordData['objects'][0]['updated_at']
+        row['sources'] = []
         for obj in reversed(wordData['objects']):
             if obj['app_name'] == '扇贝阅读' and obj['objective'] :
-                sources = [obj['objective']['article_code'], obj['objective']['paragraph_code'], obj['objective']['sentence_code'], obj['source_content'], word]
-                if 'book_code' in obj['objective']:
-                    bookNameCN, bookNameEN, articleCode, chapterNameCN, chapterNameEN = self.getChapterName(obj['objective']['book_code'], obj['objective']['article_code'])
-                    sources[0] = articleCode
-                    self.db.execute(f"UPDATE words set source_type{idx} = ?, source_name_cn{idx} = ?, source_name_en{idx} = ?, source_title_cn{idx} = ?, source_title_en{idx} = ? where id = ?", ('book', bookNameCN, bookNameEN, chapterNameCN, chapterNameEN, word))
-                elif 'article_code' in obj['objective']:
-                    self.db.execute(f"UPDATE words set source_type{idx} = ?, source_name_en{idx} = ? where id = ?", ('news', obj['source_name'], word))
-                self.db.execute(f"UPDATE words set source_article{idx} = ?, source_paragraph{idx} = ?, source_sentence{idx} = ?, source_content{idx} = ? where id = ?", sources)
+                objective = obj['objective']
+                source = dict(article=objective['article_code'], paragraph=objective['paragraph_code'], sentence=objective['sentence_code'], content=obj['source_content'])
+                if 'book_code' in objective:
+                    bookNameCN, bookNameEN, articleCode, chapterNameCN, chapterNameEN = self.getChapterName(objective['book_code'], objective['article_code'])
+                    source.update(type='book', book=('book', bookNameCN, bookNameEN, objective['book_code']), article=articleCode, title_cn=chapterNameCN, title_en=chapterNameEN)
+                else:
+                    source.update(type='news', book=('news', NEWS_BOOK_NAME), source_name=obj['source_name'])
+                row['sources'].append(source)
+        return row
+
+    def getBookId(self, type, nameCN, nameEN=None, code=None):
+        key = (type, nameCN)
+        if key not in self.bookIds:
+            self.db.execute('''INSERT INTO books (type, code, name_cn, name_en) VALUES (?, ?, ?, ?)
+                               ON CONFLICT (type, name_cn) DO UPDATE SET code = coalesce(excluded.code, code), name_en = coalesce(excluded.name_en, name_en)''',
+                            (type, code, nameCN, nameEN))
+            self.db.execute('SELECT id FROM books WHERE type = ? AND name_cn IS ?', key)
+            self.bookIds[key] = self.db.fetchone()[0]
+        return self.bookIds[key]
+
+    def saveSources(self, word, sources):
+        values = []
+        for idx, source in enumerate(sources, 1):
+            values.append((word, idx, source['type'], self.getBookId(*source['book']), source['article'], source['paragraph'], source['sentence'],
+                           source['content'], source.get('source_name'), source.get('title_cn'), source.get('title_en')))
+        self.db.executemany("INSERT INTO sources ({}) VALUES ({}) ON CONFLICT (word_id, idx) DO UPDATE SET {}".format(
+            ','.join(SOURCE_FIELDS), ','.join('?' * len(SOURCE_FIELDS)),
+            ','.join(f'{c} = excluded.{c}' for c in SOURCE_FIELDS[2:])), values)
+        self.db.execute('DELETE FROM sources WHERE word_id = ? AND idx > ?', (word, len(sources)))
+
+    def saveWords(self, rows, syncPage=None):
+        # 一个事务内批量写入单词、来源和同步游标，已有单词的例句保持不变
+        sql = "INSERT INTO words ({}) VALUES ({}) ON CONFLICT(id) DO UPDATE SET {}".format(
+            ','.join(DB_FIELDS), ','.join('?' * len(DB_FIELDS)),
+            ','.join(f'{c} = excluded.{c}' for c in DB_FIELDS[1:]))
+        with self.conn:
+            self.db.executemany(sql, ([row.get(c) for c in DB_FIELDS] for row in rows))
+            for row in rows:
+                self.saveSources(row['id'], row['sources'])
+            self.savePayloads('word', ((row['id'], row.get('payload')) for row in rows))
+            if syncPage is not None:
+                self.finishSyncPage(*syncPage)
+
+    def iterWordPages(self, startPage=1, total=None, executor=None, fanout=4, rampUp=False):
+        # 按页码顺序返回 (页码, 本页数据)；知道总数并且有线程池时同时请求后面fanout页
+        # rampUp时从1页开始逐步加倍，增量同步通常翻一两页就结束，不必多请求
+        if executor is None or not total:
+            idx = startPage
+            while True:
+                words = self.getWordsByPage(idx)
+                yield idx, words
+                if len(words['objects']) != PAGE_SIZE:
+                    return
                 idx += 1
-                if idx == 3:
-                    break
-        self.conn.commit()
 
-    def getAllWords(self):
-        idx = 1
-        while True:
-            words = self.getWordsByPage(idx)
-            wordList = [i['vocabulary']['id'] for i in words['objects']]
-            for word in wordList:
-                yield word
-            if len(wordList) != 50:
-                break
-            idx += 1
+        pages = -(-total // PAGE_SIZE)
+        nextPage = startPage
+        pending = deque()
+        window = 1 if rampUp else fanout
+        try:
+            while True:
+                while len(pending) < window and nextPage <= pages:
+                    pending.append((nextPage, executor.submit(self.getWordsByPage, nextPage)))
+                    nextPage += 1
+                if not pending:
+                    return
+                idx, future = pending.popleft()
+                words = future.result()
+                yield idx, words
+                window = min(fanout, window * 2)
+                # 同步过程中新增了单词时，最后一页可能是满的，需要继续往后翻
+                if words.get('total'):
+                    pages = max(pages, -(-words['total'] // PAGE_SIZE))
+                if len(words['objects']) == PAGE_SIZE and idx == pages:
+                    pages += 1
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def getSyncState(self, key):
+        self.db.execute('SELECT value FROM sync_state WHERE key=?', (key,))
+        row = self.db.fetchone()
+        return row[0] if row is not None else None
+
+    def setSyncState(self, key, value):
+        if value is None:
+            self.db.execute('DELETE FROM sync_state WHERE key=?', (key,))
+        else:
+            self.db.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, str(value)))
+
+    @staticmethod
+    def bookCodesOf(item):
+        for obj in item.get('objects') or []:
+            objective = obj.get('objective') or {}
+            if 'book_code' in objective:
+                yield objective['book_code']
+
+    def getWordsToSync(self, incremental=False, total=None, executor=None):
+        # 按页返回 (页码, [(单词, 是否需要下载)], 本页最新的updated_at, 本页出现的书籍)
+        # 增量模式下遇到不晚于上次同步游标的单词就停止翻页，上次同步中断时从最后完成的页之后继续
+        # 翻页过程中单词总数变了(有单词新增或删除)，前后页的单词会错位，翻完后从头再检查一遍，已经返回过的单词不再返回
+        watermark = self.getSyncState('last_updated_at') if incremental else None
+        startPage = int(self.getSyncState('sync_page') or 0) + 1
+        if startPage > 1:
+            logger.info(f'从第{startPage}页继续同步')
+        seen = set()
+        for attempt in range(3):
+            changed = False
+            for idx, words in self.iterWordPages(startPage, total, executor, rampUp=watermark is not None):
+                if total is not None and words.get('total') not in (None, total):
+                    logger.warning(f"同步过程中单词总数从{total}变为{words['total']}")
+                    total = words['total']
+                    changed = True
+                reachedUnchanged = False
+                wordList = []
+                for i in words['objects']:
+                    word = i['vocabulary']['id']
+                    updatedAt = i.get('updated_at')
+                    if watermark is not None and updatedAt is not None and updatedAt <= watermark:
+                        reachedUnchanged = True
+                    if word in seen:
+                        continue
+                    seen.add(word)
+                    if watermark is not None and updatedAt is not None and updatedAt > watermark:
+                        wordList.append((word, True))
+                    else:
+                        wordList.append((word, not self.hasWord(word)))
+                updatedAt = max((i['updated_at'] for i in words['objects'] if i.get('updated_at')), default=None)
+                bookCodes = {code for i in words['objects'] for code in self.bookCodesOf(i)}
+                yield idx, wordList, updatedAt, bookCodes
+                if reachedUnchanged:
+                    return
+            if not changed:
+                return
+            logger.info('重新检查单词列表，补上错位的单词')
+            startPage = 1
+
+    def finishSyncPage(self, page, updatedAt):
+        syncUpdatedAt = self.getSyncState('sync_updated_at')
+        if updatedAt is not None and (syncUpdatedAt is None or updatedAt > syncUpdatedAt):
+            self.setSyncState('sync_updated_at', updatedAt)
+        self.setSyncState('sync_page', page)
+
+    def finishSync(self):
+        syncUpdatedAt = self.getSyncState('sync_updated_at')
+        lastUpdatedAt = self.getSyncState('last_updated_at')
+        if syncUpdatedAt is not None and (lastUpdatedAt is None or syncUpdatedAt > lastUpdatedAt):
+            self.setSyncState('last_updated_at', syncUpdatedAt)
+        self.setSyncState('sync_updated_at', None)
+        self.setSyncState('sync_page', None)
+        self.conn.commit()
 
     def getAllBooks(self):
-        self.db.execute('''SELECT source_name_cn1 from words where source_type1 = 'book'
-                     UNION SELECT source_name_cn2 from words where source_type2 = 'book'
-                     UNION SELECT '扇贝新闻' from words where source_type1 = 'news' or source_type2 = 'news'
-                     ''')
-        return map(lambda i: i[0], reversed(self.db.fetchall()))
+        self.db.execute('SELECT name_cn, word_count FROM books WHERE word_count > 0 ORDER BY id DESC')
+        return map(tuple, self.db.fetchall())
 
-    def createWordBook(self, deckName, selectedBooks, currentConfig, audiosDownloadTasks):
-        model = getOrCreateModel("Shanbay")
-        getOrCreateModelCardTemplate(model, 'default')
-        deck = getOrCreateDeck(deckName)
-        sqlStr = "SELECT * from words where source_name_cn1 in ({0}) or source_name_cn2 in ({0})"
+    def getWordSources(self, word, limit=CARD_SOURCES):
+        self.db.execute('''SELECT sources.*, books.name_cn AS book_name_cn, books.name_en AS book_name_en,
+                                  translations.translate AS sentence_translate
+                           FROM sources LEFT JOIN books ON books.id = sources.book_id
+                                        LEFT JOIN translations ON translations.sentence = sources.sentence
+                           WHERE sources.word_id = ? ORDER BY sources.idx LIMIT ?''', (word, limit))
+        return self.db.fetchall()
 
-        if '扇贝新闻' in selectedBooks:
-            selectedBooks.remove('扇贝新闻')
-            sqlStr += " or source_type1 = 'news' or source_type2 = 'news'"
+    def getStoredExamples(self, word, limit=CARD_EXAMPLES):
+        self.db.execute('SELECT en, cn FROM examples WHERE word_id = ? ORDER BY idx LIMIT ?', (word, limit))
+        return self.db.fetchall()
 
+    def renderWord(self, row, currentConfig, audiosDownloadTasks):
         columns = list(MODEL_FIELDS)
         if not currentConfig['BrEPhonetic']:
             columns.remove('ipa_uk')
         if not currentConfig['AmEPhonetic']:
             columns.remove('ipa_us')
 
-        self.db.execute(sqlStr.format(','.join('"{0}"'.format(b) for b in selectedBooks)))
-        for row in self.db:
-            word = {k:row[k] for k in row.keys() if k in columns}
-            if currentConfig['BrEPron'] and row['ipa_uk_url']:
-                url = row['ipa_uk_url']
-                fileName = os.path.basename(url)
-                word['ipa_audio'] = "[sound:{}]".format(fileName)
-                audiosDownloadTasks.append((fileName, url))
-            if currentConfig['AmEPron'] and row['ipa_us_url']:
-                url = row['ipa_us_url']
-                fileName = os.path.basename(url)
-                word['ipa_audio'] = "[sound:{}]".format(fileName)
-                audiosDownloadTasks.append((fileName, url))
-            for i in (1,2):
-                if currentConfig['titleCN'] and row[f'source_name_cn{i}']:
-                    word[f'source_name{i}'] = row[f'source_name_cn{i}']
-                    if  row[f'source_title_cn{i}']:
-                        word[f'source_name{i}'] += '<br>' + row[f'source_title_cn{i}']
-                else:
-                    word[f'source_name{i}'] = row[f'source_name_en{i}']
-                    if  row[f'source_title_en{i}']:
-                        word[f'source_name{i}'] += ' -- ' + row[f'source_title_en{i}']
-                if currentConfig['webLink'] and row[f'source_type{i}'] in WEB_LINK:
-                    word[f'source_name{i}'] = WEB_LINK[row[f'source_type{i}']].format(
-                        row[f'source_article{i}'], word[f'source_name{i}'])
-                if currentConfig['appLink'] and row[f'source_type{i}'] in APP_LINK:
-                    word[f'source_name{i}'] = APP_LINK[row[f'source_type{i}']].format(
-                        row[f'source_article{i}'], row[f'source_paragraph{i}'], word[f'source_name{i}'])
-            addWordToDeck(deck, model, word)
+        word = {k:row[k] for k in row.keys() if k in columns}
+        # 英音美音都选时卡片上只用美音，也只下载美音
+        url = None
+        if currentConfig['BrEPron'] and row['ipa_uk_url']:
+            url = row['ipa_uk_url']
+        if currentConfig['AmEPron'] and row['ipa_us_url']:
+            url = row['ipa_us_url']
+        if url:
+            fileName = os.path.basename(url)
+            word['ipa_audio'] = "[sound:{}]".format(fileName)
+            audiosDownloadTasks.append((fileName, url))
+        for i, source in enumerate(self.getWordSources(row['id']), 1):
+            word[f'source_content{i}'] = source['content']
+            word[f'source_translate{i}'] = source['sentence_translate']
+            nameCN = source['book_name_cn'] if source['type'] == 'book' else None
+            nameEN = source['book_name_en'] if source['type'] == 'book' else source['source_name']
+            if currentConfig['titleCN'] and nameCN:
+                word[f'source_name{i}'] = nameCN
+                if source['title_cn']:
+                    word[f'source_name{i}'] += '<br>' + source['title_cn']
+            else:
+                word[f'source_name{i}'] = nameEN
+                if source['title_en']:
+                    word[f'source_name{i}'] += ' -- ' + source['title_en']
+            if currentConfig['webLink'] and source['type'] in WEB_LINK:
+                word[f'source_name{i}'] = WEB_LINK[source['type']].format(
+                    source['article'], word[f'source_name{i}'])
+            if currentConfig['appLink'] and source['type'] in APP_LINK:
+                word[f'source_name{i}'] = APP_LINK[source['type']].format(
+                    source['article'], source['paragraph'], word[f'source_name{i}'])
+        for i, example in enumerate(self.getStoredExamples(row['id']), 1):
+            word[f'examples{i}_en'] = example['en']
+            word[f'examples{i}_cn'] = example['cn']
+        return word
+
+    @staticmethod
+    def wordBookQuery(columns, selectedBooks):
+        return '''SELECT {} FROM words WHERE id IN (
+                  SELECT book_words.word_id FROM books JOIN book_words ON book_words.book_id = books.id
+                  WHERE books.name_cn IN ({}))'''.format(columns, ','.join('?' * len(selectedBooks)))
+
+    def countWordBook(self, selectedBooks):
+        return self.conn.execute(self.wordBookQuery('count(*)', selectedBooks), selectedBooks).fetchone()[0]
+
+    def iterWordBook(self, selectedBooks, currentConfig, audiosDownloadTasks):
+        # 逐行读取并生成卡片字段，返回 (扇贝单词id, 字段)，不会一次性读入所有单词
+        rows = self.conn.execute(self.wordBookQuery('*', selectedBooks), selectedBooks)
+        for row in rows:
+            yield row['id'], self.renderWord(row, currentConfig, audiosDownloadTasks)
+
+    def createWordBook(self, deckName, selectedBooks, currentConfig, audiosDownloadTasks, isInterrupted=lambda: False, onBatch=lambda count: None):
+        from .noteManager import getOrCreateDeck, getOrCreateModel, getOrCreateModelCardTemplate, addWordsToDeck
+        model = getOrCreateModel("Shanbay")
+        getOrCreateModelCardTemplate(model, 'default')
+        deck = getOrCreateDeck(deckName)
+
+        words = self.iterWordBook(selectedBooks, currentConfig, audiosDownloadTasks)
+        return addWordsToDeck(deck, model, words,
+                              lambda wordIds: self.getDeckNotes(deckName, wordIds),
+                              lambda notes: self.saveDeckNotes(deckName, notes),
+                              currentConfig.get('batchSize', 100), isInterrupted, onBatch)
+
+    def getDeckNotes(self, deckName, wordIds):
+        self.db.execute('SELECT word_id, note_id, fingerprint FROM deck_notes WHERE deck = ? AND word_id IN ({})'.format(','.join('?' * len(wordIds))),
+                        [deckName, *wordIds])
+        return {row['word_id']: (row['note_id'], row['fingerprint']) for row in self.db.fetchall()}
+
+    def saveDeckNotes(self, deckName, notes):
+        with self.conn:
+            self.db.executemany('INSERT OR REPLACE INTO deck_notes (deck, word_id, note_id, fingerprint) VALUES (?, ?, ?, ?)',
+                                ((deckName, *note) for note in notes))
 
     def getWordsWithoutExample(self):
-        self.db.execute('SELECT id from words where examples1_en is NULL')
+        self.db.execute('SELECT id from words where examples_fetched = 0')
         return self.db.fetchall()
 
-    def insertWordExamples(self, word):
-        idx = 1
-        for example in self.getWordExamples(word):
-            self.db.execute(f"UPDATE words set examples{idx}_en = ?, examples{idx}_cn = ? where id = ?", example)
-            idx += 1
-            if idx == 3:
-                break
-        self.conn.commit()
+    def fetchWordExamples(self, word):
+        examples = self.getWordExamples(word)
+        return word, self.parseExamples(word, examples), pack(examples)
+
+    def saveWordExamples(self, rows):
+        with self.conn:
+            self.db.executemany('DELETE FROM examples WHERE word_id = ?', ((word,) for word, _, _ in rows))
+            self.db.executemany('INSERT INTO examples (word_id, idx, en, cn) VALUES (?, ?, ?, ?)', (e for _, examples, _ in rows for e in examples))
+            self.db.executemany('UPDATE words SET examples_fetched = 1 WHERE id = ?', ((word,) for word, _, _ in rows))
+            self.savePayloads('examples', ((word, payload) for word, _, payload in rows))
+
+    def savePayloads(self, endpoint, payloads):
+        # 接口返回的原始内容压缩存档，从存档重新生成时payload为None，不覆盖
+        now = time.time()
+        self.db.executemany('INSERT OR REPLACE INTO payloads (word_id, endpoint, data, fetched_at) VALUES (?, ?, ?, ?)',
+                            ((word, endpoint, payload, now) for word, payload in payloads if payload is not None))
+
+    def countPayloads(self, endpoint):
+        self.db.execute('SELECT count(*) FROM payloads JOIN words ON words.id = payloads.word_id WHERE endpoint = ?', (endpoint,))
+        return self.db.fetchone()[0]
+
+    def iterPayloads(self, endpoint, chunkSize=500):
+        # 按单词id分批读取仍在生词本中的单词的存档，用单独的游标，期间可以写库
+        last = ''
+        while True:
+            chunk = self.conn.execute('''SELECT payloads.word_id, payloads.data FROM payloads JOIN words ON words.id = payloads.word_id
+                                         WHERE payloads.endpoint = ? AND payloads.word_id > ? ORDER BY payloads.word_id LIMIT ?''',
+                                      (endpoint, last, chunkSize)).fetchall()
+            if not chunk:
+                return
+            yield from chunk
+            last = chunk[-1][0]
 
     def getSentencesWithoutTranslate(self):
-        self.db.execute("SELECT id, source_type1, source_sentence1, source_translate1, source_type2, source_sentence2, source_translate2 from words where (source_type1 = 'book' and source_translate1 is null) or (source_type2 = 'book' and source_translate2 is null)")
-        return self.db.fetchall()
+        # 每个句子只返回一次，同一篇文章的句子排在一起
+        self.db.execute('''SELECT sources.sentence, min(sources.article) AS article FROM sources
+                           LEFT JOIN translations ON translations.sentence = sources.sentence
+                           WHERE sources.type = 'book' AND sources.idx <= ? AND translations.sentence IS NULL
+                           GROUP BY sources.sentence ORDER BY article''', (CARD_SOURCES,))
+        return [dict(row) for row in self.db.fetchall()]
 
-    def insertSentenceTranslates(self, row):
-        if row['source_type1'] == 'book' and row['source_translate1'] is None:
-            self.db.execute(f"UPDATE words set source_translate1 = ? where id = ?", (self.getSentenceTranslate(row['source_sentence1']), row['id']))
-        if row['source_type2'] == 'book' and row['source_translate2'] is None:
-            self.db.execute(f"UPDATE words set source_translate2 = ? where id = ?", (self.getSentenceTranslate(row['source_sentence2']), row['id']))
-        self.conn.commit()
+    def needsExamples(self, word):
+        self.db.execute('SELECT examples_fetched FROM words WHERE id = ?', (word,))
+        row = self.db.fetchone()
+        return row is None or not row[0]
+
+    def getSourcesToTranslate(self, row):
+        # 返回row中卡片用到的、还没有翻译的句子
+        sources = []
+        for source in row['sources'][:CARD_SOURCES]:
+            if source['type'] != 'book':
+                continue
+            self.db.execute('SELECT 1 FROM translations WHERE sentence = ?', (source['sentence'],))
+            if self.db.fetchone() is None:
+                sources.append(dict(sentence=source['sentence'], article=source['article']))
+        return sources
+
+    def fetchSentenceTranslate(self, row):
+        return row['sentence'], row['article'], self.getSentenceTranslate(row['sentence'])
+
+    def saveSentenceTranslates(self, rows):
+        with self.conn:
+            self.db.executemany('INSERT OR REPLACE INTO translations (sentence, article, translate) VALUES (?, ?, ?)', rows)
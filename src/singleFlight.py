@@ -0,0 +1,45 @@
+import logging
+from threading import Lock, Event
+
+logger = logging.getLogger(__name__)
+
+
+class Call:
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # 同一资源同时只发出一个请求，其他调用者等待并共享这个请求的结果
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
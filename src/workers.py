@@ -1,10 +1,8 @@
 import json
 import logging
-import requests
-from os import path
-from urllib3 import Retry
-from .misc import ThreadPool
-from requests.adapters import HTTPAdapter
+from .misc import Executor
+from .scheduler import SyncScheduler
+from .progress import ProgressReporter
 from aqt.qt import QObject, pyqtSignal, QThread
 
 class LoginStateCheckWorker(QObject):
@@ -24,106 +22,96 @@ class LoginStateCheckWorker(QObject):
         else:
             self.logFailed.emit()
 
-class WordDownloadWorker(QObject):
+class SyncWorker(QObject):
     start = pyqtSignal()
-    tick = pyqtSignal()
+    progress = pyqtSignal(int, int, float, float)
     done = pyqtSignal()
-    logger = logging.getLogger(__name__ + '.WordDownloadWorker')
+    # 无论成功、中断还是出错都会发出，用于恢复界面
+    finished = pyqtSignal()
+    logger = logging.getLogger(__name__ + '.SyncWorker')
 
-    def __init__(self, api):
+    def __init__(self, api, config):
         super().__init__()
         self.api = api
+        self.config = config
 
     def run(self):
         currentThread = QThread.currentThread()
 
-        for word in self.api.getAllWords():
-            if currentThread.isInterruptionRequested():
-                return
-            self.api.insertWord(word)
-            self.tick.emit()
-
-        self.done.emit()
-
-class WordExampleDownloadWorker(QObject):
-    start = pyqtSignal()
-    tick = pyqtSignal()
-    done = pyqtSignal()
-    logger = logging.getLogger(__name__ + '.WordExampleDownloadWorker')
-
-    def __init__(self, api):
-        super().__init__()
-        self.api = api
-
-    def run(self):
-        currentThread = QThread.currentThread()
-
-        for row in self.api.getWordsWithoutExample():
-            if currentThread.isInterruptionRequested():
-                return
-            self.api.insertWordExamples(row['id'])
-            self.tick.emit()
-
-        self.done.emit()
-
-class SentenceTranslateDownloadWorker(QObject):
+        scheduler = SyncScheduler(
+            self.api,
+            concurrency=self.config.get('concurrency', 1),
+            incremental=self.config.get('incremental', False),
+            batchSize=self.config.get('batchSize', 100),
+            example=self.config['example'],
+            translate=self.config['translate'],
+        )
+        progress = ProgressReporter(self.progress.emit)
+        scheduler.isInterrupted = currentThread.isInterruptionRequested
+        scheduler.onTick = progress.advance
+        scheduler.onTotal = progress.setTotal
+        try:
+            if scheduler.run(self.api.getWordNumber()):
+                self.done.emit()
+        except Exception:
+            self.logger.exception('同步失败')
+        finally:
+            progress.finish()
+            self.finished.emit()
+
+class DeckBuildWorker(QObject):
+    # 在后台线程中分批创建单词书，每批渲染出的发音立即交给下载线程池，内存占用与单词数无关
     start = pyqtSignal()
-    tick = pyqtSignal()
-    done = pyqtSignal()
-    logger = logging.getLogger(__name__ + '.SentenceTranslateDownloadWorker')
+    progress = pyqtSignal(int, int, float, float)
+    done = pyqtSignal(dict)
+    logger = logging.getLogger(__name__ + '.DeckBuildWorker')
 
-    def __init__(self, api):
+    def __init__(self, api, store, deckName, selectedBooks, config):
         super().__init__()
         self.api = api
+        self.store = store
+        self.deckName = deckName
+        self.selectedBooks = selectedBooks
+        self.config = config
 
     def run(self):
         currentThread = QThread.currentThread()
-
-        for row in self.api.getSentencesWithoutTranslate():
-            if currentThread.isInterruptionRequested():
-                return
-            self.api.insertSentenceTranslates(row)
-            self.tick.emit()
-
-        self.done.emit()
-
-class AudioDownloadWorker(QObject):
-    start = pyqtSignal()
-    tick = pyqtSignal()
-    done = pyqtSignal()
-    logger = logging.getLogger(__name__ + '.AudioDownloadWorker')
-    retries = Retry(total=5, backoff_factor=3, status_forcelist=[500, 502, 503, 504])
-    session = requests.Session()
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-
-    def __init__(self, audios: [tuple]):
-        super().__init__()
-        self.audios = audios
-
-    def run(self):
-        currentThread = QThread.currentThread()
+        batchSize = self.config.get('batchSize', 100)
+        progress = ProgressReporter(self.progress.emit, self.api.countWordBook(self.selectedBooks))
+        audios = []
 
         def __download(fileName, url):
             try:
-                if currentThread.isInterruptionRequested():
-                    return
-                r = self.session.get(url, stream=True)
-
-                if not path.exists(fileName) or path.getsize(fileName) != int(r.headers['Content-Length']):
-                    with open(fileName, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=1024):
-                            if chunk:
-                                f.write(chunk)
-                    self.logger.info(f'{fileName} 下载完成')
-                else:
-                    self.logger.info(f'{fileName} 跳过下载')
+                self.store.download(fileName, url, executor.isCancelled)
             except Exception as e:
                 self.logger.warning(f'下载{fileName}:{url}异常: {e}')
+                raise
             finally:
-                self.tick.emit()
+                progress.advance()
 
-        with ThreadPool(max_workers=3) as executor:
-            for fileName, url in self.audios:
+        def onBatch(count):
+            if currentThread.isInterruptionRequested():
+                executor.cancel()
+                return
+            tasks = self.store.missing(audios)
+            audios.clear()
+            progress.setTotal(progress.total + len(tasks))
+            progress.advance(count)
+            for fileName, url in tasks:
                 executor.submit(__download, fileName, url)
-        self.done.emit()
+
+        stats = dict(added=0, updated=0, skipped=0, finished=False)
+        try:
+            # 下载队列最多积压一批，制卡不会远远跑在下载前面
+            with Executor(self.config.get('audioConcurrency', 3), max_queue=batchSize, name='audio') as executor:
+                # 中断时立即取消下载，阻塞在submit上的制卡线程和正在进行的下载都会停下
+                executor.cancelWhen(currentThread.isInterruptionRequested)
+                stats.update(self.api.createWordBook(self.deckName, self.selectedBooks, self.config, audios,
+                                                     currentThread.isInterruptionRequested, onBatch))
+                stats['finished'] = executor.join(currentThread.isInterruptionRequested) and not currentThread.isInterruptionRequested()
+        except Exception:
+            self.logger.exception('创建单词书失败')
+        finally:
+            progress.finish()
+            self.store.logStats()
+            self.done.emit(stats)